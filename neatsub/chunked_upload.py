@@ -0,0 +1,202 @@
+"""
+    Resumable chunked uploads for NeatSub
+    A large subtitle pack is sent as a sequence of chunks appended to one partial file on disk,
+    so an interrupted upload can ask for the stored offset and continue from there.
+    All state lives in the upload directory, so any gunicorn worker can serve any chunk:
+        <temp_dir>/uploads/<upload_id>/upload.json   file name, total size, creation time
+        <temp_dir>/uploads/<upload_id>/data.part     bytes received so far (offset = its size)
+    On completion the partial file is renamed to the original file name, no copy is made. While it is processed
+    the upload answers 409; an upload turned away by the stage limits is reopened so complete can be sent again.
+"""
+import os
+import re
+import json
+import time
+import shutil
+import secrets
+from typing import Dict, BinaryIO
+
+try:
+    import fcntl
+except ImportError:  # Windows, chunks of one upload are not written concurrently there
+    fcntl = None
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+WRITE_CHUNK_SIZE = 64 * 1024  # bytes read from the request stream per write
+UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+class ChunkedUploadError(ValueError):
+    """ A chunked upload request that cannot be served, with the HTTP status to answer """
+
+    def __init__(self, message: str, status_code: int = 400, offset: int = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.offset = offset
+
+
+class ChunkedUploadStore:
+    def __init__(self, temp_dir: str, max_bytes: int, expiry: int):
+        self.root = os.path.join(temp_dir, 'uploads')
+        self.max_bytes = max_bytes
+        self.expiry = expiry
+
+    def _upload_dir(self, upload_id: str) -> str:
+        # The id comes from the URL, never let it name anything but an upload directory
+        if not UPLOAD_ID_RE.match(upload_id or ''):
+            raise ChunkedUploadError('Unknown upload', 404)
+        upload_dir = os.path.join(self.root, upload_id)
+        if not os.path.isdir(upload_dir):
+            raise ChunkedUploadError('Unknown upload', 404)
+        return upload_dir
+
+    def _read_meta(self, upload_dir: str) -> Dict:
+        try:
+            with open(os.path.join(upload_dir, 'upload.json'), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            raise ChunkedUploadError('Unknown upload', 404)
+
+    def _part_path(self, upload_dir: str) -> str:
+        part_path = os.path.join(upload_dir, 'data.part')
+        if not os.path.exists(part_path):
+            # Renamed by assemble(), the upload directory goes once the pipeline is done
+            raise ChunkedUploadError('Upload is complete and being processed', 409)
+        return part_path
+
+    def create(self, filename: str, total_size: int, source_name: str = None) -> Dict:
+        """
+        Start an upload of total_size bytes, filename must already be validated / secured.
+        source_name is the original file name, handed to the pipeline for parsing on completion.
+        """
+        if total_size <= 0:
+            raise ChunkedUploadError('Invalid upload size')
+        if total_size > self.max_bytes:
+            raise ChunkedUploadError(f'Upload exceeds {self.max_bytes} bytes', 413)
+
+        self.cleanup_expired()
+        upload_id = secrets.token_hex(16)
+        upload_dir = os.path.join(self.root, upload_id)
+        os.makedirs(upload_dir)
+        open(os.path.join(upload_dir, 'data.part'), 'wb').close()
+        with open(os.path.join(upload_dir, 'upload.json'), 'w', encoding='utf-8') as f:
+            json.dump({'filename': filename, 'source_name': source_name or filename, 'size': total_size,
+                       'created_at': time.time()}, f)
+
+        logger.info(f"→ Chunked upload started: {filename} ({total_size} bytes, id {upload_id})")
+        return {'upload_id': upload_id, 'filename': filename, 'size': total_size, 'offset': 0}
+
+    def status(self, upload_id: str) -> Dict:
+        """ Stored offset of an upload, where the client resumes """
+        upload_dir = self._upload_dir(upload_id)
+        meta = self._read_meta(upload_dir)
+        try:
+            offset = os.path.getsize(self._part_path(upload_dir))
+        except FileNotFoundError:
+            raise ChunkedUploadError('Upload is complete and being processed', 409)
+        return {
+            'upload_id': upload_id,
+            'filename': meta['filename'],
+            'size': meta['size'],
+            'offset': offset
+        }
+
+    def write_chunk(self, upload_id: str, offset: int, stream: BinaryIO) -> int:
+        """ Append the request body at offset (must equal the stored offset), return the new offset """
+        upload_dir = self._upload_dir(upload_id)
+        meta = self._read_meta(upload_dir)
+
+        try:
+            f = open(self._part_path(upload_dir), 'r+b')
+        except FileNotFoundError:  # assembled in between
+            raise ChunkedUploadError('Upload is complete and being processed', 409)
+        with f:
+            if fcntl:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    raise ChunkedUploadError('Another chunk of this upload is being written', 409)
+
+            stored = f.seek(0, os.SEEK_END)
+            if offset != stored:
+                # Lost response or duplicate chunk, the client resumes from the stored offset
+                raise ChunkedUploadError('Offset mismatch', 409, offset=stored)
+
+            written = stored
+            try:
+                while True:
+                    chunk = stream.read(WRITE_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    written += len(chunk)
+                    if written > meta['size']:
+                        raise ChunkedUploadError('Chunk exceeds the upload size', 413, offset=stored)
+                    f.write(chunk)
+            except ChunkedUploadError:
+                f.truncate(stored)
+                raise
+            except Exception:
+                # Connection dropped mid-chunk: keep what was received, the client asks for the offset
+                f.flush()
+                logger.warning(f"✗ Chunk of upload {upload_id} interrupted at {f.tell()} bytes")
+                raise
+            return f.tell()
+
+    def assemble(self, upload_id: str) -> str:
+        """ Turn a fully received upload into its file (a rename, not a copy), return the file path """
+        upload_dir = self._upload_dir(upload_id)
+        meta = self._read_meta(upload_dir)
+        part_path = self._part_path(upload_dir)
+
+        try:
+            stored = os.path.getsize(part_path)
+            if stored != meta['size']:
+                raise ChunkedUploadError('Upload is incomplete', 409, offset=stored)
+            file_path = os.path.join(upload_dir, meta['filename'])
+            os.replace(part_path, file_path)
+        except FileNotFoundError:  # a concurrent complete renamed it first
+            raise ChunkedUploadError('Upload is complete and being processed', 409)
+        logger.info(f"✓ Chunked upload complete: {meta['filename']}")
+        return file_path
+
+    def source_name(self, upload_id: str) -> str:
+        """ Original file name of an upload """
+        meta = self._read_meta(self._upload_dir(upload_id))
+        return meta.get('source_name', meta['filename'])
+
+    def reopen(self, upload_id: str) -> None:
+        """ Undo assemble() for an upload the pipeline turned away, so complete can be sent again """
+        upload_dir = self._upload_dir(upload_id)
+        meta = self._read_meta(upload_dir)
+        try:
+            os.replace(os.path.join(upload_dir, meta['filename']), os.path.join(upload_dir, 'data.part'))
+        except FileNotFoundError:
+            # Already placed (a single subtitle file), nothing left to retry
+            shutil.rmtree(upload_dir, ignore_errors=True)
+            return
+        logger.info(f"→ Chunked upload reopened: {meta['filename']} (server busy)")
+
+    def discard(self, upload_id: str) -> None:
+        """ Remove an upload directory and everything left in it """
+        try:
+            shutil.rmtree(self._upload_dir(upload_id), ignore_errors=True)
+        except ChunkedUploadError:
+            pass
+
+    def cleanup_expired(self) -> None:
+        """ Remove uploads that have not received a chunk for longer than the expiry """
+        if not os.path.isdir(self.root):
+            return
+        deadline = time.time() - self.expiry
+        for upload_id in os.listdir(self.root):
+            upload_dir = os.path.join(self.root, upload_id)
+            try:
+                last_write = max(os.path.getmtime(os.path.join(upload_dir, name)) for name in os.listdir(upload_dir))
+            except (OSError, ValueError):
+                continue
+            if last_write < deadline:
+                logger.info(f"→ Removing expired upload: {upload_id}")
+                shutil.rmtree(upload_dir, ignore_errors=True)
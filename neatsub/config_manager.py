@@ -3,7 +3,10 @@
 """
 import os
 import json
-from typing import List, Dict
+from typing import List, Dict, Optional
+
+from language_tokens import DEFAULT_LANGUAGE_TOKENS
+from filename_patterns import DEFAULT_USER_RULES
 
 class ConfigManager:
     DEFAULT_CONFIG = {
@@ -12,6 +15,37 @@ class ConfigManager:
         "subtitle_file_extensions": [".srt", ".ass", ".ssa"],
         "subtitle_pack_extensions": [".zip", ".rar", ".7z"],
         "temp_dir": "/.tmp",
+        "archive_max_depth": 3,
+        "archive_max_total_bytes": 512 * 1024 * 1024,
+        "archive_max_files": 2000,
+        "match_cache_file": "",
+        "title_aliases_file": "",
+        "language_tokens": DEFAULT_LANGUAGE_TOKENS,
+        "filename_patterns": DEFAULT_USER_RULES,
+        "parse_workers": 0,
+        "parallel_parse_threshold": 20000,
+        "library_index_ttl": 600,
+        "index_snapshots": True,
+        "index_snapshot_dir": "",
+        "upload_max_bytes": 4 * 1024 * 1024 * 1024,
+        "upload_expiry": 24 * 60 * 60,
+        "admin_token": "",
+        "profiles_dir": "",
+        "stage_limits": {
+            "extraction": {"concurrency": 2, "queue_depth": 8, "wait_timeout": 30},
+            "scanning": {"concurrency": 1, "queue_depth": 8, "wait_timeout": 120},
+            "moving": {"concurrency": 4, "queue_depth": 32, "wait_timeout": 30}
+        },
+        "watch": {
+            "inboxes": [],
+            "quarantine_dir": "",
+            "log_file": "",
+            "poll_interval": 2,
+            "stable_seconds": 5,
+            "debounce_seconds": 10,
+            "lang_suffix": "",
+            "overwrite": False
+        },
         "media_libraries": [
             {
                 "library_name": "Default Library",
@@ -102,6 +136,194 @@ class ConfigManager:
         """Set temporary directory path"""
         self._config["temp_dir"] = temp_dir
         
+    @property
+    def archive_max_depth(self) -> int:
+        """Get the maximum nesting depth for archives inside subtitle packs"""
+        return self._config.get("archive_max_depth", self.DEFAULT_CONFIG["archive_max_depth"])
+
+    @archive_max_depth.setter
+    def archive_max_depth(self, depth: int) -> None:
+        """Set the maximum nesting depth for archives inside subtitle packs"""
+        self._config["archive_max_depth"] = depth
+
+    @property
+    def archive_max_total_bytes(self) -> int:
+        """Get the maximum number of bytes extracted from one subtitle pack"""
+        return self._config.get("archive_max_total_bytes", self.DEFAULT_CONFIG["archive_max_total_bytes"])
+
+    @archive_max_total_bytes.setter
+    def archive_max_total_bytes(self, max_bytes: int) -> None:
+        """Set the maximum number of bytes extracted from one subtitle pack"""
+        self._config["archive_max_total_bytes"] = max_bytes
+
+    @property
+    def archive_max_files(self) -> int:
+        """Get the maximum number of files extracted from one subtitle pack"""
+        return self._config.get("archive_max_files", self.DEFAULT_CONFIG["archive_max_files"])
+
+    @archive_max_files.setter
+    def archive_max_files(self, max_files: int) -> None:
+        """Set the maximum number of files extracted from one subtitle pack"""
+        self._config["archive_max_files"] = max_files
+
+    @property
+    def match_cache_path(self) -> str:
+        """Get match cache file path (next to the config file by default)"""
+        return (self._config.get("match_cache_file")
+                or os.path.join(os.path.dirname(self._config_path), 'match_cache.json'))
+
+    @match_cache_path.setter
+    def match_cache_path(self, cache_path: str) -> None:
+        """Set match cache file path"""
+        self._config["match_cache_file"] = cache_path
+
+    @property
+    def title_aliases_path(self) -> str:
+        """Get title alias table path (next to the config file by default)"""
+        return (self._config.get("title_aliases_file")
+                or os.path.join(os.path.dirname(self._config_path), 'title_aliases.json'))
+
+    @title_aliases_path.setter
+    def title_aliases_path(self, alias_path: str) -> None:
+        """Set title alias table path"""
+        self._config["title_aliases_file"] = alias_path
+
+    @property
+    def language_tokens(self) -> Dict[str, str]:
+        """Get the file name token -> language suffix table (e.g. chs -> zh-CN)"""
+        return self._config.get("language_tokens", self.DEFAULT_CONFIG["language_tokens"])
+
+    @language_tokens.setter
+    def language_tokens(self, tokens: Dict[str, str]) -> None:
+        """Set the file name token -> language suffix table"""
+        self._config["language_tokens"] = tokens
+
+    @property
+    def filename_patterns(self) -> List[Dict]:
+        """Get the custom file name rules, tried after the built-in SxxEyy rules and before the season pack rules"""
+        return self._config.get("filename_patterns", self.DEFAULT_CONFIG["filename_patterns"])
+
+    @filename_patterns.setter
+    def filename_patterns(self, rules: List[Dict]) -> None:
+        """Set the custom file name rules"""
+        self._config["filename_patterns"] = rules
+
+    @property
+    def parse_workers(self) -> int:
+        """Get the number of processes parsing file names of large libraries (0 = all cores)"""
+        return self._config.get("parse_workers", self.DEFAULT_CONFIG["parse_workers"])
+
+    @parse_workers.setter
+    def parse_workers(self, workers: int) -> None:
+        """Set the number of processes parsing file names of large libraries (0 = all cores)"""
+        self._config["parse_workers"] = workers
+
+    @property
+    def parallel_parse_threshold(self) -> int:
+        """Get the number of video files above which file names are parsed in parallel"""
+        return self._config.get("parallel_parse_threshold", self.DEFAULT_CONFIG["parallel_parse_threshold"])
+
+    @parallel_parse_threshold.setter
+    def parallel_parse_threshold(self, threshold: int) -> None:
+        """Set the number of video files above which file names are parsed in parallel"""
+        self._config["parallel_parse_threshold"] = threshold
+
+    @property
+    def library_index_ttl(self) -> int:
+        """Get the number of seconds a library index is reused before it is rescanned"""
+        return self._config.get("library_index_ttl", self.DEFAULT_CONFIG["library_index_ttl"])
+
+    @library_index_ttl.setter
+    def library_index_ttl(self, ttl: int) -> None:
+        """Set the number of seconds a library index is reused before it is rescanned"""
+        self._config["library_index_ttl"] = ttl
+
+    @property
+    def index_snapshot_path(self) -> Optional[str]:
+        """Get the directory of library index snapshots (next to the config file by default), None if disabled"""
+        if not self._config.get("index_snapshots", self.DEFAULT_CONFIG["index_snapshots"]):
+            return None
+        return (self._config.get("index_snapshot_dir")
+                or os.path.join(os.path.dirname(self._config_path), 'index_snapshots'))
+
+    @index_snapshot_path.setter
+    def index_snapshot_path(self, snapshot_dir: str) -> None:
+        """Set the directory of library index snapshots"""
+        self._config["index_snapshot_dir"] = snapshot_dir
+
+    @property
+    def upload_max_bytes(self) -> int:
+        """Get the maximum size of a chunked upload"""
+        return self._config.get("upload_max_bytes", self.DEFAULT_CONFIG["upload_max_bytes"])
+
+    @upload_max_bytes.setter
+    def upload_max_bytes(self, max_bytes: int) -> None:
+        """Set the maximum size of a chunked upload"""
+        self._config["upload_max_bytes"] = max_bytes
+
+    @property
+    def upload_expiry(self) -> int:
+        """Get the number of seconds an unfinished chunked upload is kept for resuming"""
+        return self._config.get("upload_expiry", self.DEFAULT_CONFIG["upload_expiry"])
+
+    @upload_expiry.setter
+    def upload_expiry(self, expiry: int) -> None:
+        """Set the number of seconds an unfinished chunked upload is kept for resuming"""
+        self._config["upload_expiry"] = expiry
+
+    @property
+    def admin_token(self) -> str:
+        """Get the token of admin-only features such as request profiling (empty = disabled)"""
+        return self._config.get("admin_token", self.DEFAULT_CONFIG["admin_token"])
+
+    @admin_token.setter
+    def admin_token(self, token: str) -> None:
+        """Set the token of admin-only features"""
+        self._config["admin_token"] = token
+
+    @property
+    def profiles_path(self) -> str:
+        """Get the directory of request profiles (next to the config file by default)"""
+        return (self._config.get("profiles_dir")
+                or os.path.join(os.path.dirname(self._config_path), 'profiles'))
+
+    @profiles_path.setter
+    def profiles_path(self, profiles_dir: str) -> None:
+        """Set the directory of request profiles"""
+        self._config["profiles_dir"] = profiles_dir
+
+    @property
+    def stage_limits(self) -> Dict[str, Dict]:
+        """Get the concurrency / queue depth / wait timeout of each processing stage, missing keys filled with defaults"""
+        limits = {}
+        for stage, defaults in self.DEFAULT_CONFIG["stage_limits"].items():
+            limits[stage] = dict(defaults)
+            limits[stage].update(self._config.get("stage_limits", {}).get(stage, {}))
+        return limits
+
+    @stage_limits.setter
+    def stage_limits(self, limits: Dict[str, Dict]) -> None:
+        """Set the limits of the processing stages"""
+        self._config["stage_limits"] = limits
+
+    @property
+    def watch_settings(self) -> Dict:
+        """Get watch-folder daemon settings, missing keys filled with defaults"""
+        settings = dict(self.DEFAULT_CONFIG["watch"])
+        settings.update(self._config.get("watch", {}))
+        return settings
+
+    @watch_settings.setter
+    def watch_settings(self, settings: Dict) -> None:
+        """Set watch-folder daemon settings"""
+        self._config["watch"] = settings
+
+    @property
+    def watch_log_path(self) -> str:
+        """Get watch-folder daemon log file path (next to the config file by default)"""
+        return (self.watch_settings["log_file"]
+                or os.path.join(os.path.dirname(self._config_path), 'watch_log.jsonl'))
+
     @property
     def media_libraries(self) -> List[Dict]:
         """Get media library configurations"""
@@ -112,13 +334,16 @@ class ConfigManager:
         """Set media library configurations"""
         self._config["media_libraries"] = libraries
         
-    def add_media_library(self, library_name: str, library_path: str) -> None:
-        """Add a new media library"""
+    def add_media_library(self, library_name: str, library_path: str, max_concurrent_reads: int = 0,
+                          max_entries_per_second: int = 0) -> None:
+        """Add a new media library (scan I/O limits: 0 = unlimited)"""
         if "media_libraries" not in self._config:
             self._config["media_libraries"] = []
         self._config["media_libraries"].append({
             "library_name": library_name,
-            "library_path": library_path
+            "library_path": library_path,
+            "max_concurrent_reads": max_concurrent_reads,
+            "max_entries_per_second": max_entries_per_second
         })
         
     def remove_media_library(self, library_name: str) -> None:
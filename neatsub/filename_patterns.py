@@ -0,0 +1,169 @@
+"""
+    File name parse rules for NeatSub
+    Rules are regular expressions with named groups:
+        show (required), season, episode, episode_end, or air_year + air_month + air_day for daily shows
+    All rules are compiled into one alternation, tried in order at the start of the name, so the first rule that
+    matches wins: the built-in episode rules (SxxEyy...), then the user rules from the config, then the built-in
+    season pack rules. A custom rule that matches a date or an episode number later in the name cannot take
+    a file that carries an SxxEyy token.
+    A new rule set is validated and compiled once, then swapped in with a single assignment.
+"""
+import re
+import json
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# Optional second episode of a multi-episode file: S01E01-E02, S01E01E02, S01E01-02
+EPISODE_RANGE = r'(?:(?:-?E|-)(?P<episode_end>\d{1,2})(?!\d))?'
+
+BUILTIN_EPISODE_RULES = [
+    {"name": "S01E01", "pattern": r'(?P<show>.+?)[\. ]S(?P<season>\d{1,2})E(?P<episode>\d{1,2})' + EPISODE_RANGE},
+    {"name": "1x01", "pattern": r'(?P<show>.+?)[\. ](?P<season>\d{1,2})x(?P<episode>\d{1,2})'},
+    # ShowName.Season1Episode01 or ShowName Season 1 Episode 01 (maybe useless, the secure_filename will remove the spaces)
+    {"name": "Season 1 Episode 01",
+     "pattern": r'(?P<show>.+?)[\. ]Season[\. ]?(?P<season>\d{1,2})[\. ]?Episode[\. ]?(?P<episode>\d{1,2})'},
+    {"name": "Season1Episode01", "pattern": r'(?P<show>.+?)[\. ]Season(?P<season>\d{1,2})Episode(?P<episode>\d{1,2})'},
+    {"name": "S01.E01", "pattern": r'(?P<show>.+?)[\. ]S(?P<season>\d{1,2})\.E(?P<episode>\d{1,2})' + EPISODE_RANGE},
+    # ShowName_S01E01_Additional_Info
+    {"name": "_S01E01_",
+     "pattern": r'(?P<show>.+?)[_\- ]S(?P<season>\d{1,2})E(?P<episode>\d{1,2})' + EPISODE_RANGE + r'[_\- ]'}
+]
+
+BUILTIN_SEASON_RULES = [
+    # Season packs without episode numbers: ShowName.S01.Complete, ShowName.Season.1
+    {"name": "S01 (season pack)", "pattern": r'(?P<show>.+?)[\. _\-]S(?P<season>\d{1,2})(?=[\. _\-]|$)'},
+    {"name": "Season 1 (season pack)", "pattern": r'(?P<show>.+?)[\. _\-]Season[\. _\-]?(?P<season>\d{1,2})(?=[\. _\-]|$)'}
+]
+
+BUILTIN_RULES = BUILTIN_EPISODE_RULES + BUILTIN_SEASON_RULES
+
+# Examples shipped in the default config: anime releases and daily shows
+DEFAULT_USER_RULES = [
+    {"name": "anime", "pattern": r'^\[[^\]]+\]\s*(?P<show>.+?)\s+-\s+(?P<episode>\d{1,4})(?!\d)', "season": 1},
+    {"name": "daily",
+     "pattern": r'(?P<show>.+?)[\. _\-](?P<air_year>(?:19|20)\d{2})[\. _\-](?P<air_month>\d{2})[\. _\-](?P<air_day>\d{2})(?!\d)'}
+]
+
+ALLOWED_GROUPS = {'show', 'season', 'episode', 'episode_end', 'air_year', 'air_month', 'air_day'}
+AIR_DATE_GROUPS = {'air_year', 'air_month', 'air_day'}
+INLINE_GLOBAL_FLAGS = re.compile(r'\(\?[aiLmsux]+\)')
+
+
+def _wrap_rule(i: int, pattern: str) -> str:
+    """ Alternative of rule i in the combined pattern, its group names prefixed with r{i}_ """
+    pattern = re.sub(r'\(\?P<(\w+)>', rf'(?P<r{i}_\1>', pattern)
+    pattern = re.sub(r'\(\?P=(\w+)\)', rf'(?P=r{i}_\1)', pattern)
+    return f'(?P<r{i}>{pattern})'
+
+
+def validate_rule(rule: Dict) -> Optional[str]:
+    """ Error message for an invalid rule, None if it is valid """
+    if not isinstance(rule, dict) or not rule.get('name') or not isinstance(rule.get('pattern'), str):
+        return "A rule needs a name and a pattern"
+    name = rule['name']
+    try:
+        compiled = re.compile(rule['pattern'], re.IGNORECASE)
+    except re.error as e:
+        return f"{name}: invalid pattern ({str(e)})"
+    # Global flags such as (?i) only compile at the start of the whole alternation and would apply to every rule
+    if INLINE_GLOBAL_FLAGS.search(rule['pattern']):
+        return f"{name}: inline flags like (?i) are not supported, use a scoped group such as (?-i:...) instead"
+    try:
+        re.compile(_wrap_rule(0, rule['pattern']), re.IGNORECASE)
+    except re.error as e:
+        return f"{name}: invalid pattern ({str(e)})"
+
+    groups = set(compiled.groupindex)
+    if 'show' not in groups:
+        return f"{name}: the pattern needs a (?P<show>...) group"
+    if groups - ALLOWED_GROUPS:
+        return f"{name}: unknown groups {sorted(groups - ALLOWED_GROUPS)}, allowed: {sorted(ALLOWED_GROUPS)}"
+    if groups & AIR_DATE_GROUPS and not AIR_DATE_GROUPS <= groups:
+        return f"{name}: air_year, air_month and air_day go together"
+    if compiled.groups != len(compiled.groupindex):
+        return f"{name}: use (?:...) instead of unnamed capturing groups"
+    if not isinstance(rule.get('season', 1), int):
+        return f"{name}: season must be a number"
+    return None
+
+
+class FilenameMatcher:
+    """ One compiled alternation over all rules, group names prefixed with the rule position """
+
+    def __init__(self, user_rules: List[Dict]):
+        self.user_rules = user_rules
+        self.rules = [dict(rule, source='builtin') for rule in BUILTIN_EPISODE_RULES] + \
+                     [dict(rule, source='user') for rule in user_rules] + \
+                     [dict(rule, source='builtin') for rule in BUILTIN_SEASON_RULES]
+        alternatives = [_wrap_rule(i, rule['pattern']) for i, rule in enumerate(self.rules)]
+        self._pattern = re.compile('|'.join(alternatives), re.IGNORECASE)
+
+    def match(self, stem: str) -> Optional[Tuple[str, str, int, Optional[int], Optional[int], int]]:
+        """ (rule name, show, season, episode, episode end, match end) of the first rule matching stem """
+        match = self._pattern.search(stem)
+        if not match:
+            return None
+
+        # The rule's wrapping group closes last, so it names the alternative that matched
+        i = int(match.lastgroup[1:])
+        rule = self.rules[i]
+        groups = {name.split('_', 1)[1]: value for name, value in match.groupdict().items()
+                  if value is not None and name.startswith(f'r{i}_')}
+
+        if 'air_year' in groups:
+            # Daily shows: the year is the season, MMDD the episode
+            season = int(groups['air_year'])
+            episode = episode_end = int(groups['air_month']) * 100 + int(groups['air_day'])
+        else:
+            season = int(groups['season']) if 'season' in groups else rule.get('season', 1)
+            episode = episode_end = int(groups['episode']) if 'episode' in groups else None
+            if episode is not None and 'episode_end' in groups and int(groups['episode_end']) > episode:
+                episode_end = int(groups['episode_end'])
+        return rule['name'], groups['show'], season, episode, episode_end, match.end()
+
+
+_active_matcher = FilenameMatcher([])
+_active_key = json.dumps([], sort_keys=True)
+_install_lock = threading.Lock()
+
+
+def get_filename_matcher() -> FilenameMatcher:
+    return _active_matcher
+
+
+def install_filename_rules(user_rules: List[Dict]) -> List[str]:
+    """
+    Make user_rules (plus the built-in rules) the active rule set, skipping invalid rules.
+    Returns the validation errors. Compiles only when the rules changed.
+    """
+    global _active_matcher, _active_key
+    key = json.dumps(user_rules, sort_keys=True)
+    if key == _active_key:
+        return []
+
+    errors = []
+    valid_rules = []
+    for rule in user_rules:
+        error = validate_rule(rule)
+        if error:
+            errors.append(error)
+            logger.warning(f"✗ Ignoring file name rule: {error}")
+        else:
+            valid_rules.append(rule)
+
+    with _install_lock:
+        if key != _active_key:
+            try:
+                matcher = FilenameMatcher(valid_rules)
+            except re.error as e:
+                # Rules that compile alone but not side by side, keep the active rules
+                error = f"The file name rules do not compile together ({str(e)}), keeping the active rules"
+                logger.error(f"✗ {error}")
+                return errors + [error]
+            _active_matcher, _active_key = matcher, key  # readers see the old or the new matcher, never half of one
+            logger.info(f"File name rules: {len(valid_rules)} custom + {len(BUILTIN_RULES)} built-in")
+    return errors
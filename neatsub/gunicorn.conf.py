@@ -0,0 +1,10 @@
+"""
+    gunicorn settings for NeatSub: `gunicorn -c gunicorn.conf.py run:app` (the Dockerfile does)
+"""
+
+
+def post_fork(server, worker):
+    # NEATSUB_INDEX_WARMUP=background indexes in a thread of each worker, started here and not in the
+    # --preload master: threads don't survive fork
+    import run
+    run.start_index_warmup()
@@ -0,0 +1,83 @@
+"""
+    Library index snapshots for NeatSub
+    The directory states of a scanned library (mtime, subdirectories, parsed videos per directory) are written
+    to one file per library, so a restarted container re-reads only the directories that changed meanwhile.
+    File layout:
+        NEATSUB-INDEX\n
+        {"version": 1, "python": "3.9", "library_path": ..., "key": ..., ...}\n    JSON header, checked first
+        zlib(marshal(rows))                                                        mmap()ed, decompressed in one go
+    A snapshot written by another format version, Python version (marshal format) or with other
+    parse settings (key) is ignored and the library is scanned in full.
+"""
+from typing import Dict, List, Optional, Tuple
+import os
+import sys
+import json
+import mmap
+import time
+import zlib
+import marshal
+import hashlib
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+SNAPSHOT_MAGIC = b'NEATSUB-INDEX\n'
+SNAPSHOT_VERSION = 1
+PYTHON_VERSION = f"{sys.version_info[0]}.{sys.version_info[1]}"
+
+
+def snapshot_path(snapshot_dir: str, library_path: str) -> str:
+    """ Snapshot file of a library, named by a hash of its path """
+    name = hashlib.sha1(os.path.abspath(library_path).encode('utf-8', 'surrogateescape')).hexdigest()[:16]
+    return os.path.join(snapshot_dir, f"{name}.index")
+
+
+def write_snapshot(path: str, library_path: str, key: str, rows: List[tuple]) -> None:
+    """ Write rows (directory, mtime, subdirectory names, video field tuples, rule counts) atomically """
+    header = {
+        'version': SNAPSHOT_VERSION,
+        'python': PYTHON_VERSION,
+        'library_path': library_path,
+        'key': key,
+        'created_at': time.time(),
+        'directories': len(rows)
+    }
+    body = zlib.compress(marshal.dumps(rows), 1)  # fastest level, the volume is local disk
+
+    part_path = f"{path}.{os.getpid()}.part"  # one per gunicorn worker
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(part_path, 'wb') as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(json.dumps(header).encode('utf-8') + b'\n')
+            f.write(body)
+        os.replace(part_path, path)
+    except OSError as e:
+        logger.warning(f"Could not save index snapshot {path}: {str(e)}")
+        return
+    logger.info(f"✓ Index snapshot saved: {library_path} ({len(rows)} directories, {len(body) / 1024:.0f} KiB)")
+
+
+def read_snapshot(path: str, library_path: str, key: str) -> Optional[Tuple[Dict, List[tuple]]]:
+    """ (header, rows) of a snapshot matching library_path and key, None if missing, stale or unreadable """
+    try:
+        with open(path, 'rb') as f:
+            if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                logger.warning(f"Ignoring index snapshot {path}: not a snapshot file")
+                return None
+            header = json.loads(f.readline())
+            if (header.get('version') != SNAPSHOT_VERSION or header.get('python') != PYTHON_VERSION
+                    or header.get('library_path') != library_path or header.get('key') != key):
+                logger.info(f"Ignoring index snapshot {path}: written by another version or with other settings")
+                return None
+            body_offset = f.tell()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                rows = marshal.loads(zlib.decompress(memoryview(mapped)[body_offset:]))
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, EOFError, TypeError, zlib.error) as e:
+        logger.warning(f"Ignoring unreadable index snapshot {path}: {str(e)}")
+        return None
+    return header, rows
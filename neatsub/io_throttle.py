@@ -0,0 +1,194 @@
+"""
+    I/O throttling for media library scans
+    Libraries on SMB / NFS shares are read by the media server at the same time, so a scan
+    can be limited per library to a number of concurrent directory reads and a rate of
+    directory entries per second. Scan progress is kept per library for the web UI.
+    Read slots are lock files shared by all gunicorn workers and the watch daemon (see stage_limits.py):
+        <temp_dir>/io/<library hash>.read.<n>.lock
+    The entry rate is a token bucket per process.
+"""
+from typing import Dict, Iterator, List, Tuple
+import os
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+
+from stage_limits import POLL_INTERVAL, try_lock_slot, unlock_slot
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class IOBudget:
+    """ Concurrent directory reads (lock file slots, across processes) and directory entries per second (token bucket) """
+
+    def __init__(self, library_path: str, lock_dir: str, max_concurrent_reads: int = 0,
+                 max_entries_per_second: int = 0):
+        self.lock_dir = lock_dir
+        self.max_concurrent_reads = max_concurrent_reads
+        self.max_entries_per_second = max_entries_per_second
+        self._lock = threading.Lock()
+        self._tokens = float(max_entries_per_second)
+        self._last_refill = time.monotonic()
+
+        self._slot_paths = []
+        if max_concurrent_reads > 0:
+            os.makedirs(lock_dir, exist_ok=True)
+            name = hashlib.sha1(os.path.abspath(library_path).encode('utf-8', 'surrogateescape')).hexdigest()[:16]
+            self._slot_paths = [os.path.join(lock_dir, f"{name}.read.{n}.lock") for n in range(max_concurrent_reads)]
+
+    @contextmanager
+    def read_slot(self):
+        """ Hold one of the library's read slots while reading a directory, waiting for a free one """
+        if not self._slot_paths:
+            yield
+            return
+        handle = None
+        while handle is None:
+            for path in self._slot_paths:
+                handle = try_lock_slot(path)
+                if handle is not None:
+                    break
+            else:
+                time.sleep(POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            unlock_slot(handle)
+
+    def consume(self, entries: int) -> None:
+        """ Take entries from the bucket, sleeping off any debt (a large directory may overdraw it) """
+        if self.max_entries_per_second <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(float(self.max_entries_per_second),
+                               self._tokens + (now - self._last_refill) * self.max_entries_per_second)
+            self._last_refill = now
+            self._tokens -= entries
+            wait = -self._tokens / self.max_entries_per_second if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class ScanProgress:
+    """ Progress of the latest scan of one library """
+
+    def __init__(self, library_path: str):
+        self.library_path = library_path
+        self.state = 'listing'   # listing -> parsing -> done
+        self.directories = 0
+        self.entries = 0
+        self.videos = 0
+        self.unchanged = 0   # directories not read again, unchanged since the previous scan
+        self.rule_counts: Dict[str, int] = {}   # file name rule -> video files it parsed
+        self.unparsed = 0
+        self.started_at = time.time()
+        self.finished_at = None
+
+    def to_dict(self) -> Dict:
+        return {
+            'library_path': self.library_path,
+            'state': self.state,
+            'directories': self.directories,
+            'entries': self.entries,
+            'videos': self.videos,
+            'unchanged_directories': self.unchanged,
+            'rule_counts': self.rule_counts,
+            'unparsed': self.unparsed,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+
+
+# A directory modified this recently may change again without a new mtime (coarse timestamps on SMB / FAT)
+MTIME_SLACK_NS = 3 * 10 ** 9
+
+# Shared by every scan of the same library in this process
+_io_budgets: Dict[str, IOBudget] = {}
+_scan_progress: Dict[str, ScanProgress] = {}
+_registry_lock = threading.Lock()
+
+
+def get_io_budget(library_path: str, lock_dir: str, max_concurrent_reads: int = 0,
+                  max_entries_per_second: int = 0) -> IOBudget:
+    """ Budget of a library, recreated when its limits change in the config """
+    with _registry_lock:
+        budget = _io_budgets.get(library_path)
+        if (budget is None or budget.lock_dir != lock_dir or budget.max_concurrent_reads != max_concurrent_reads
+                or budget.max_entries_per_second != max_entries_per_second):
+            budget = IOBudget(library_path, lock_dir, max_concurrent_reads, max_entries_per_second)
+            _io_budgets[library_path] = budget
+        return budget
+
+
+def start_scan_progress(library_path: str) -> ScanProgress:
+    progress = ScanProgress(library_path)
+    with _registry_lock:
+        _scan_progress[library_path] = progress
+    return progress
+
+
+def get_scan_progress() -> List[Dict]:
+    """ Progress of the latest scan of every library scanned by this process """
+    with _registry_lock:
+        return [progress.to_dict() for progress in _scan_progress.values()]
+
+
+def throttled_walk(top: str, budget: IOBudget, progress: ScanProgress = None,
+                   known: Dict[str, tuple] = None) -> Iterator[Tuple[str, List[str], List[str], int]]:
+    """
+    os.walk() replacement (top-down) that reads every directory through the library's I/O budget.
+    Yields (directory, subdirectory names, file names, mtime). With known ({directory: (mtime, subdirectory names, ...)}
+    from an earlier walk) every directory is stat()ed first and an unchanged one is not read again: its file names
+    are None and its subdirectories come from known. mtime is None if not tracked (known is None) or too recent to trust.
+    """
+    stack = [top]
+    while stack:
+        directory = stack.pop()
+        mtime = None
+        if known is not None:
+            try:
+                with budget.read_slot():
+                    mtime = os.stat(directory).st_mtime_ns
+            except OSError as e:
+                logger.warning(f"Cannot read directory {directory}: {str(e)}")
+                continue
+            budget.consume(1)
+            if time.time_ns() - mtime < MTIME_SLACK_NS:
+                mtime = None  # may still change within the same mtime tick, read it again next time
+            state = known.get(directory)
+            if mtime is not None and state is not None and state[0] == mtime:
+                if progress:
+                    progress.directories += 1
+                    progress.unchanged += 1
+                yield directory, list(state[1]), None, mtime
+                stack.extend(os.path.join(directory, name) for name in reversed(state[1]))
+                continue
+
+        try:
+            with budget.read_slot(), os.scandir(directory) as it:
+                entries = list(it)
+        except OSError as e:
+            logger.warning(f"Cannot read directory {directory}: {str(e)}")
+            continue
+
+        budget.consume(len(entries))
+        if progress:
+            progress.directories += 1
+            progress.entries += len(entries)
+
+        dirs = []
+        files = []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)  # d_type, no extra round trip on most mounts
+            except OSError:
+                is_dir = False
+            (dirs if is_dir else files).append(entry.name)
+
+        yield directory, dirs, files, mtime
+
+        # Same order as os.walk: subdirectories depth first, in listing order
+        stack.extend(os.path.join(directory, name) for name in reversed(dirs))
@@ -0,0 +1,62 @@
+"""
+    Language tokens in subtitle file names
+    Fansub packs name their subtitles Show.S01E01.chs.ass, .cht.ass, .eng.srt, .chs&eng.ass ...
+    A configurable token -> Jellyfin language suffix table is compiled into one case-insensitive
+    regular expression (longest token first), so each name is scanned once for all tokens.
+"""
+import re
+import threading
+from typing import Dict, Optional
+
+DEFAULT_LANGUAGE_TOKENS = {
+    "chs&eng": "zh-CN.en",
+    "cht&eng": "zh-TW.en",
+    "chs": "zh-CN",
+    "简体": "zh-CN",
+    "简中": "zh-CN",
+    "cht": "zh-TW",
+    "big5": "zh-TW",
+    "繁体": "zh-TW",
+    "繁體": "zh-TW",
+    "繁中": "zh-TW",
+    "eng": "en",
+    "英文": "en",
+    "jpn": "ja",
+    "kor": "ko"
+}
+
+
+class LanguageTokens:
+    """ Compiled token table, a token only counts when no letter or digit is glued to it (.chs. [chs] chs&eng) """
+
+    def __init__(self, table: Dict[str, str]):
+        self._suffixes = {token.lower(): suffix for token, suffix in table.items() if token and suffix}
+        tokens = sorted(self._suffixes, key=len, reverse=True)
+        self._pattern = re.compile(
+            r'(?<![0-9a-z])(' + '|'.join(re.escape(token) for token in tokens) + r')(?![0-9a-z])',
+            re.IGNORECASE) if tokens else None
+
+    def suffix_for(self, name: str) -> Optional[str]:
+        """ Language suffix of the tokens found in name, in order ('chs.eng' -> 'zh-CN.en'), None if there are none """
+        if not self._pattern:
+            return None
+        languages = []
+        for match in self._pattern.finditer(name):
+            for language in self._suffixes[match.group(1).lower()].split('.'):
+                if language not in languages:
+                    languages.append(language)
+        return '.'.join(languages) or None
+
+
+_compiled: Dict[tuple, LanguageTokens] = {}
+_compiled_lock = threading.Lock()
+
+
+def get_language_tokens(table: Dict[str, str]) -> LanguageTokens:
+    """ Compiled table, shared by every call with the same table """
+    key = tuple(sorted(table.items()))
+    with _compiled_lock:
+        language_tokens = _compiled.get(key)
+        if language_tokens is None:
+            language_tokens = _compiled[key] = LanguageTokens(table)
+        return language_tokens
@@ -0,0 +1,127 @@
+"""
+    Persistent match-result cache for NeatSub
+    Maps a normalized subtitle identity (show, year, season, episode range) plus the
+    generation stamp of the configured libraries to the matched video path and score.
+    A library's generation is a fingerprint of its video list (VideoIndex.generation),
+    recorded after every scan, so any change seen by a scan invalidates the cached results.
+"""
+import os
+import re
+import json
+import hashlib
+from typing import List, Dict
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class MatchCache:
+    VERSION = 1
+    MAX_ENTRIES = 50000
+
+    def __init__(self, cache_path: str):
+        """Initialize MatchCache, the cache file is loaded lazily"""
+        self._cache_path = cache_path
+        self._generations: Dict[str, str] = {}  # library path -> fingerprint of its videos
+        self._entries: Dict[str, Dict] = {}     # subtitle key + stamp -> match result
+        self._loaded_mtime = None
+        self._dirty = False
+
+    @staticmethod
+    def subtitle_key(subtitle_info: Dict) -> str:
+        """Normalized identity of a subtitle, language suffix and release tags are ignored"""
+        show_name = re.sub(r'\s+', ' ', subtitle_info['clean_show_name'].lower()).strip()
+        return '|'.join(str(part) for part in (
+            show_name,
+            subtitle_info.get('year', ''),
+            subtitle_info['season'],
+            subtitle_info['episode'],
+            subtitle_info['episode_end']
+        ))
+
+    def _stamp(self, library_paths: List[str]) -> str:
+        """Generation stamp of the configured libraries, in their configured order"""
+        generations = [[path, self._generations.get(path)] for path in library_paths]
+        return hashlib.sha1(json.dumps(generations).encode('utf-8')).hexdigest()[:16]
+
+    def _reload_if_changed(self) -> None:
+        """Pick up results written by other workers since the last load"""
+        try:
+            mtime = os.path.getmtime(self._cache_path)
+        except OSError:
+            return
+        if mtime == self._loaded_mtime:
+            return
+
+        try:
+            with open(self._cache_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable match cache {self._cache_path}: {str(e)}")
+            return
+
+        self._loaded_mtime = mtime
+        if data.get('version') != self.VERSION:
+            return
+        self._generations.update(data.get('generations', {}))
+        for key, entry in data.get('entries', {}).items():
+            self._entries.setdefault(key, entry)
+
+    def get(self, subtitle_info: Dict, library_paths: List[str]) -> Dict:
+        """Cached match for the subtitle under the current library generation, None on a miss"""
+        self._reload_if_changed()
+        entry = self._entries.get(f"{self.subtitle_key(subtitle_info)}|{self._stamp(library_paths)}")
+        if not entry:
+            return None
+
+        # The generation only changes on a scan, so check the video is still there
+        if not os.path.exists(entry['video_path']):
+            return None
+        return entry
+
+    def put(self, subtitle_info: Dict, library_paths: List[str], library_path: str, video_path: str,
+            score: int) -> None:
+        """Remember a resolved match (kept in memory until save())"""
+        self._entries[f"{self.subtitle_key(subtitle_info)}|{self._stamp(library_paths)}"] = {
+            'library_path': library_path,
+            'video_path': video_path,
+            'score': score
+        }
+        self._dirty = True
+
+    def record_scan(self, library_path: str, generation: str) -> bool:
+        """Update the library generation from a scan (VideoIndex.generation), return True if the library changed"""
+        if self._generations.get(library_path) == generation:
+            return False
+        logger.debug(f"Library generation changed: {library_path}")
+        self._generations[library_path] = generation
+        self._dirty = True
+        return True
+
+    def save(self, library_paths: List[str]) -> None:
+        """Write the cache file, dropping entries of older library generations"""
+        if not self._dirty:
+            return
+
+        suffix = f"|{self._stamp(library_paths)}"
+        entries = {key: entry for key, entry in self._entries.items() if key.endswith(suffix)}
+        # dicts keep insertion order, so this keeps the most recent results
+        entries = dict(list(entries.items())[-self.MAX_ENTRIES:])
+
+        part_path = f"{self._cache_path}.{os.getpid()}.part"  # one per gunicorn worker
+        try:
+            os.makedirs(os.path.dirname(self._cache_path) or '.', exist_ok=True)
+            with open(part_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'version': self.VERSION,
+                    'generations': self._generations,
+                    'entries': entries
+                }, f)
+            os.replace(part_path, self._cache_path)
+        except OSError as e:
+            logger.warning(f"Could not save match cache {self._cache_path}: {str(e)}")
+            return
+
+        self._entries = entries
+        self._loaded_mtime = os.path.getmtime(self._cache_path)
+        self._dirty = False
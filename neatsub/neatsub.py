@@ -8,18 +8,27 @@
         4. Move and rename the subtitle file to the video file's folder
 """
 
-from typing import List, Dict
+from typing import List, Dict, Set, Union, Iterator
 import os
+import sys
+import time
+import hashlib
+import json
 import shutil  # move and rename
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import repeat
 
 # Extract
+import tempfile
 import zipfile
-import rarfile
-import py7zr
+# rarfile / py7zr (and its compression stack) are imported on first use, see _extract_archive()
 
 # Match
 import re
-from fuzzywuzzy import fuzz  # fuzzy match (for show name)
+import bisect
+import threading
+# fuzzywuzzy (fuzzy match for show name) is imported on first use, see match_subtitle_to_video()
 from werkzeug.utils import secure_filename
 
 # Logging
@@ -32,181 +41,1036 @@ logger = logging.getLogger(__name__)
 
 # Import ConfigManager
 from config_manager import ConfigManager
+from match_cache import MatchCache
+from title_aliases import TitleAliases, normalize_title
+from language_tokens import get_language_tokens
+from filename_patterns import get_filename_matcher, install_filename_rules
+from stage_limits import get_stage_limiter
+from index_snapshot import snapshot_path, read_snapshot, write_snapshot
 
+# Library scan I/O budgets
+from io_throttle import get_io_budget, start_scan_progress, throttled_walk
 
-def extract_subtitle_pack(file_path: str, temp_dir: str, allowed_extensions: List[str]) -> List[str]:
-    """ Extract subtitle files from zip, rar, 7z file """
-    extracted_files = []
+# Subtitle content processing
+from subtitle_tools import ASS_EXTENSIONS, detect_encoding, transcode_to_utf8, convert_ass_to_srt, retime_subtitle
+
+
+COPY_CHUNK_SIZE = 64 * 1024  # bytes read per step when streaming archive members
+
+
+class ExtractionLimitError(ValueError):
+    """ Raised when a subtitle pack exceeds the configured extraction budget """
+
+
+class _ExtractionBudget:
+    """ Depth / total bytes / file count budget shared by a pack and all its nested archives """
+
+    def __init__(self, max_depth: int, max_total_bytes: int, max_files: int):
+        self.max_depth = max_depth
+        self.max_total_bytes = max_total_bytes
+        self.max_files = max_files
+        self.total_bytes = 0
+        self.file_count = 0
+
+    def add_file(self, name: str, declared_size: int = 0) -> None:
+        """ Reserve a file slot, rejecting members whose declared size already breaks the budget """
+        self.file_count += 1
+        if self.file_count > self.max_files:
+            raise ExtractionLimitError(
+                f"Too many files in subtitle pack (limit: {self.max_files})")
+        if self.total_bytes + declared_size > self.max_total_bytes:
+            raise ExtractionLimitError(
+                f"Subtitle pack too large at {name} (limit: {self.max_total_bytes} bytes)")
+
+    def add_bytes(self, name: str, size: int) -> None:
+        """ Account for bytes actually written (archive headers may lie about sizes) """
+        self.total_bytes += size
+        if self.total_bytes > self.max_total_bytes:
+            raise ExtractionLimitError(
+                f"Subtitle pack too large at {name} (limit: {self.max_total_bytes} bytes)")
+
+
+def _safe_member_path(dest_dir: str, member_name: str) -> str:
+    """ Resolve an archive member name inside dest_dir, None if it would escape it """
+    member_name = member_name.replace('\\', '/').lstrip('/')
+    dest_path = os.path.normpath(os.path.join(dest_dir, member_name))
+    if os.path.commonpath([os.path.abspath(dest_dir), os.path.abspath(dest_path)]) != os.path.abspath(dest_dir):
+        return None
+    return dest_path
+
+
+def _stream_members(archive_ref, dest_dir: str, wanted_exts: Set[str], budget: _ExtractionBudget) -> List[str]:
+    """ Copy the wanted members of a zip / rar archive to disk, one fixed-size chunk at a time """
+    written_files = []
+
+    for info in archive_ref.infolist():
+        if info.is_dir() or os.path.splitext(info.filename)[1].lower() not in wanted_exts:
+            continue
+
+        dest_path = _safe_member_path(dest_dir, info.filename)
+        if not dest_path:
+            logger.warning(f"✗ Skipping unsafe archive member: {info.filename}")
+            continue
+
+        budget.add_file(info.filename, info.file_size)
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        with archive_ref.open(info) as src, open(dest_path, 'wb') as dst:
+            while True:
+                chunk = src.read(COPY_CHUNK_SIZE)
+                if not chunk:
+                    break
+                budget.add_bytes(info.filename, len(chunk))
+                dst.write(chunk)
+
+        written_files.append(dest_path)
+
+    return written_files
+
+
+def _extract_7z_members(file_path: str, dest_dir: str, wanted_exts: Set[str], budget: _ExtractionBudget) -> List[str]:
+    """ Extract the wanted members of a 7z archive, checking the budget against the headers first """
+    import py7zr
+
+    with py7zr.SevenZipFile(file_path, 'r') as sz_ref:
+        targets = []
+        for info in sz_ref.list():
+            if info.is_directory or os.path.splitext(info.filename)[1].lower() not in wanted_exts:
+                continue
+            if not _safe_member_path(dest_dir, info.filename):
+                logger.warning(f"✗ Skipping unsafe archive member: {info.filename}")
+                continue
+            budget.add_file(info.filename, info.uncompressed)
+            budget.add_bytes(info.filename, info.uncompressed)
+            targets.append(info.filename)
+
+        if targets:
+            # py7zr decompresses straight to disk, it never holds a whole member in memory
+            sz_ref.extract(path=dest_dir, targets=targets)
+
+    return [os.path.join(dest_dir, target) for target in targets
+            if os.path.isfile(os.path.join(dest_dir, target))]
+
+
+def _extract_archive(file_path: str, dest_dir: str, allowed_extensions: Set[str], pack_extensions: Set[str],
+                     budget: _ExtractionBudget, depth: int) -> List[str]:
+    """ Extract one archive level and recurse into nested subtitle packs """
     file_ext = os.path.splitext(file_path)[1].lower()
+    wanted_exts = allowed_extensions | pack_extensions
 
-    try:
-        if file_ext == '.zip':
-            with zipfile.ZipFile(file_path, 'r') as zip_ref:
-                zip_ref.extractall(temp_dir)
-        elif file_ext == '.rar':
-            with rarfile.RarFile(file_path, 'r') as rar_ref:
-                rar_ref.extractall(temp_dir)
-        elif file_ext == '.7z':
-            with py7zr.SevenZipFile(file_path, 'r') as sz_ref:
-                sz_ref.extractall(temp_dir)
-
-        # Walk through the temp directory to find subtitle files
-        for root, _, files in os.walk(temp_dir):
-            for file in files:
-                if any(file.lower().endswith(ext) for ext in allowed_extensions):
-                    extracted_files.append(os.path.join(root, file))
+    if file_ext == '.zip':
+        with zipfile.ZipFile(file_path, 'r') as zip_ref:
+            written_files = _stream_members(zip_ref, dest_dir, wanted_exts, budget)
+    elif file_ext == '.rar':
+        import rarfile
+        with rarfile.RarFile(file_path, 'r') as rar_ref:
+            written_files = _stream_members(rar_ref, dest_dir, wanted_exts, budget)
+    elif file_ext == '.7z':
+        written_files = _extract_7z_members(file_path, dest_dir, wanted_exts, budget)
+    else:
+        raise ValueError(f"Unsupported archive type: {file_ext}")
 
+    extracted_files = []
+    for written_file in written_files:
+        if os.path.splitext(written_file)[1].lower() not in pack_extensions:
+            extracted_files.append(written_file)
+            continue
+
+        # Nested subtitle pack (e.g. a .rar inside a .zip)
+        if depth + 1 > budget.max_depth:
+            logger.warning(
+                f"✗ Skipping nested archive beyond depth {budget.max_depth}: {os.path.basename(written_file)}")
+        else:
+            logger.debug(f"→ Extracting nested pack: {os.path.basename(written_file)}")
+            nested_dir = tempfile.mkdtemp(prefix='pack_', dir=os.path.dirname(written_file))
+            extracted_files.extend(
+                _extract_archive(written_file, nested_dir, allowed_extensions, pack_extensions, budget, depth + 1))
+        os.remove(written_file)
+
+    return extracted_files
+
+
+def extract_subtitle_pack(file_path: str, temp_dir: str, allowed_extensions: List[str],
+                          pack_extensions: List[str] = None, max_depth: int = 3,
+                          max_total_bytes: int = 512 * 1024 * 1024, max_files: int = 2000,
+                          extract_dir: str = None) -> List[str]:
+    """
+    Extract subtitle files from zip, rar, 7z file (recursing into nested packs).
+    Into extract_dir if given (the caller removes it once the files are processed), else a new pack_* folder.
+    """
+    allowed_exts = {ext.lower() for ext in allowed_extensions}
+    pack_exts = {ext.lower() for ext in (pack_extensions or ['.zip', '.rar', '.7z'])}
+    budget = _ExtractionBudget(max_depth, max_total_bytes, max_files)
+
+    # Each pack gets its own folder so files from other uploads are never picked up
+    if extract_dir is None:
+        os.makedirs(temp_dir, exist_ok=True)
+        extract_dir = tempfile.mkdtemp(prefix='pack_', dir=temp_dir)
+
+    try:
+        extracted_files = _extract_archive(file_path, extract_dir, allowed_exts, pack_exts, budget, depth=0)
     except Exception as e:
         logger.error(f"Error extracting {file_path}: {str(e)}")
+        shutil.rmtree(extract_dir, ignore_errors=True)
         raise
 
     logger.debug(
-        f"Extracted {len(extracted_files)} subtitle files from {file_path}")
+        f"Extracted {len(extracted_files)} subtitle files ({budget.total_bytes} bytes) from {file_path}")
     return extracted_files
 
 
-def scan_media_library(library_path: str, video_extensions: List[str]) -> List[Dict]:
-    """ Scan media library for video files """
-    video_files = []  # include video info and full path
+PARSE_CHUNK_MIN_FILES = 2000  # file names sent to a parse worker at once (at least)
 
-    for root, _, files in os.walk(library_path):
+
+class VideoRecord:
+    """ Parsed video file, slotted with interned show names (a large library holds one per episode) """
+    __slots__ = ('show_name', 'clean_show_name', 'year', 'season', 'episode', 'episode_end',
+                 'suffix', 'directory', 'file_name', 'subtitle_files')
+
+    def __init__(self, video_info: Dict, directory: str, file_name: str, subtitle_files: tuple = ()):
+        # Episodes of a show share one string object per name / year / folder
+        self.show_name = sys.intern(video_info['show_name'])
+        self.clean_show_name = sys.intern(video_info['clean_show_name'])
+        self.year = sys.intern(video_info['year']) if 'year' in video_info else None
+        self.season = video_info['season']
+        self.episode = video_info['episode']
+        self.episode_end = video_info['episode_end']
+        self.suffix = video_info['suffix']
+        self.directory = directory
+        self.file_name = file_name
+        self.subtitle_files = subtitle_files  # sidecar subtitles found next to the video by the scan
+
+    @classmethod
+    def from_fields(cls, directory: str, fields: tuple) -> 'VideoRecord':
+        """ Build a record from a _parse_listing_chunk() tuple """
+        file_name, show_name, clean_show_name, year, season, episode, episode_end, suffix, subtitle_files = fields
+        record = cls.__new__(cls)
+        record.show_name = sys.intern(show_name)
+        record.clean_show_name = sys.intern(clean_show_name)
+        record.year = sys.intern(year) if year else None
+        record.season = season
+        record.episode = episode
+        record.episode_end = episode_end
+        record.suffix = suffix
+        record.directory = directory
+        record.file_name = file_name
+        record.subtitle_files = subtitle_files
+        return record
+
+    def to_fields(self) -> tuple:
+        """ Inverse of from_fields() (index snapshots) """
+        return (self.file_name, self.show_name, self.clean_show_name, self.year, self.season, self.episode,
+                self.episode_end, self.suffix, self.subtitle_files)
+
+    @property
+    def full_path(self) -> str:
+        return os.path.join(self.directory, self.file_name)
+
+    @property
+    def secure_show_name(self) -> str:
+        return secure_filename(self.show_name)
+
+    @property
+    def subtitle_languages(self) -> Set[str]:
+        """
+        Lowercase language suffixes of the sidecar subtitles, e.g. {'zh-cn', 'en'} for Video.zh-CN.srt + Video.en.ass.
+        A multi-part suffix counts as a whole and per part (Video.zh-CN.en.srt: 'zh-cn.en', 'zh-cn', 'en'),
+        an untagged sidecar (Video.srt) as ''.
+        """
+        stem_length = len(os.path.splitext(self.file_name)[0])
+        languages = set()
+        for subtitle_file in self.subtitle_files:
+            suffix = os.path.splitext(subtitle_file)[0][stem_length + 1:].lower()
+            languages.add(suffix)
+            if '.' in suffix:
+                languages.update(suffix.split('.'))
+        return languages
+
+    def to_dict(self) -> Dict:
+        """ Same keys as parse_video_filename() plus full_path """
+        result = {
+            'show_name': self.show_name,
+            'secure_show_name': self.secure_show_name,
+            'clean_show_name': self.clean_show_name,
+            'season': self.season,
+            'episode': self.episode,
+            'episode_end': self.episode_end,
+            'suffix': self.suffix,
+            'original_name': self.file_name,
+            'full_path': self.full_path,
+            'subtitle_files': list(self.subtitle_files)
+        }
+        if self.year:
+            result['year'] = self.year
+        return result
+
+
+def _match_sidecars(videos: List[str], subtitles: List[str]) -> Dict[str, List[str]]:
+    """ Sidecar subtitle names per video file name of one directory: <video stem>[.<language>].<ext> """
+    stems = {os.path.splitext(video)[0]: video for video in videos}
+    sidecars = {}
+    for subtitle in subtitles:
+        base = os.path.splitext(subtitle)[0]
+        # Video stems contain dots too, so try every prefix ending before a dot, longest first
+        while True:
+            if base in stems:
+                sidecars.setdefault(stems[base], []).append(subtitle)
+                break
+            if '.' not in base:
+                break
+            base = base.rsplit('.', 1)[0]
+    return sidecars
+
+
+def _parse_listing_chunk(listings: List[tuple], filename_rules: List[Dict] = None) -> List[tuple]:
+    """
+    Parse a chunk of (directory, [video file names], [subtitle file names]) listings into
+    (directory, compact tuples, number of files each file name rule matched (None: no rule matched)),
+    a tuple being (file name, show name, clean show name, year, season, episode, episode end, suffix, sidecar subtitles).
+    Runs in the parse worker processes for large libraries, so it only returns plain tuples;
+    workers get the parent's file name rules (filename_rules), compiled once per worker.
+    """
+    if filename_rules is not None:
+        install_filename_rules(filename_rules)
+    parsed_listings = []
+    for directory, files, subtitles in listings:
+        sidecars = _match_sidecars(files, subtitles) if subtitles else {}
+        parsed = []
+        rule_counts: Dict[str, int] = {}
         for file in files:
-            if any(file.lower().endswith(ext) for ext in video_extensions):
-                video_info = parse_video_filename(file)
-                if video_info:
-                    video_info['full_path'] = os.path.join(
-                        root, file)  # append full path
-                    video_files.append(video_info)
-
-    logger.debug(f"Found {len(video_files)} video files in {library_path}")
+            video_info = parse_video_filename(file)
+            rule = video_info['rule'] if video_info else None
+            rule_counts[rule] = rule_counts.get(rule, 0) + 1
+            if video_info:
+                parsed.append((file, video_info['show_name'], video_info['clean_show_name'],
+                               video_info.get('year'), video_info['season'], video_info['episode'],
+                               video_info['episode_end'], video_info['suffix'], tuple(sidecars.get(file, ()))))
+        parsed_listings.append((directory, parsed, rule_counts))
+    return parsed_listings
+
+
+def _chunk_listings(listings: List[tuple], chunk_size: int) -> List[List[tuple]]:
+    """ Group directory listings into chunks of about chunk_size videos (a directory is never split) """
+    chunks = []
+    chunk = []
+    chunk_files = 0
+    for listing in listings:
+        chunk.append(listing)
+        chunk_files += len(listing[1])
+        if chunk_files >= chunk_size:
+            chunks.append(chunk)
+            chunk = []
+            chunk_files = 0
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def _lower_priority() -> None:
+    """ Parse worker initializer: yield the CPU to the media server """
+    try:
+        os.nice(10)
+    except (AttributeError, OSError):
+        pass
+
+
+def scan_media_library(library_path: str, video_extensions: List[str], parse_workers: int = 0,
+                       parallel_threshold: int = 20000, max_concurrent_reads: int = 0,
+                       max_entries_per_second: int = 0, subtitle_extensions: List[str] = None,
+                       directory_states: Dict[str, tuple] = None, lock_dir: str = None) -> List[VideoRecord]:
+    """
+    Scan media library for video files (parsing names on all cores for large libraries),
+    recording the sidecar subtitles of each video from the same directory listing.
+    directory_states ({directory: (mtime, subdirectory names, video records, rule counts)}) makes the scan
+    incremental: directories whose mtime hasn't changed since the previous scan keep their records without
+    being read again, and the dict is updated in place for the next scan.
+    lock_dir holds the read slots shared with other processes (max_concurrent_reads), default <tmp>/neatsub_io.
+    """
+    video_files = []  # include video info and full path
+    io_budget = get_io_budget(library_path, lock_dir or os.path.join(tempfile.gettempdir(), 'neatsub_io'),
+                              max_concurrent_reads, max_entries_per_second)
+    progress = start_scan_progress(library_path)
+
+    # List first: (directory, [video file names], [subtitle file names]), within the library's I/O budget
+    listings = []
+    file_count = 0
+    new_states: Dict[str, tuple] = {}   # walk order, so the video order matches a full scan
+    for root, dirs, files, mtime in throttled_walk(library_path, io_budget, progress, directory_states):
+        if files is None:
+            new_states[root] = directory_states[root]  # unchanged
+            continue
+        new_states[root] = (mtime, tuple(dirs), (), {})
+        videos = [file for file in files if any(file.lower().endswith(ext) for ext in video_extensions)]
+        if videos:
+            subtitles = [file for file in files
+                         if any(file.lower().endswith(ext) for ext in subtitle_extensions or [])]
+            listings.append((root, videos, subtitles))
+            file_count += len(videos)
+    progress.state = 'parsing'
+
+    parse_workers = parse_workers or os.cpu_count() or 1
+    parsed_listings = None
+    if parse_workers > 1 and file_count >= parallel_threshold:
+        chunk_size = max(PARSE_CHUNK_MIN_FILES, file_count // (parse_workers * 4))
+        filename_rules = get_filename_matcher().user_rules
+        logger.debug(f"Parsing {file_count} file names with {parse_workers} processes")
+        try:
+            with ProcessPoolExecutor(max_workers=parse_workers, initializer=_lower_priority) as pool:
+                # map() keeps the listing order, so matching ties resolve like a serial scan
+                parsed_listings = [listing for chunk in pool.map(_parse_listing_chunk,
+                                                                 _chunk_listings(listings, chunk_size),
+                                                                 repeat(filename_rules))
+                                   for listing in chunk]
+        except (OSError, BrokenProcessPool) as e:
+            logger.warning(f"Parallel parsing unavailable, parsing serially: {str(e)}")
+    if parsed_listings is None:
+        parsed_listings = _parse_listing_chunk(listings)
+
+    for directory, parsed, rule_counts in parsed_listings:
+        directory = sys.intern(directory)  # shared by every video in the folder
+        mtime, dirs = new_states[directory][:2]
+        records = tuple(VideoRecord.from_fields(directory, fields) for fields in parsed)
+        new_states[directory] = (mtime, dirs, records, rule_counts)
+
+    rule_counts: Dict[str, int] = {}
+    for _, _, records, directory_counts in new_states.values():
+        video_files.extend(records)
+        for rule, count in directory_counts.items():
+            rule_counts[rule] = rule_counts.get(rule, 0) + count
+    if directory_states is not None:
+        directory_states.clear()
+        directory_states.update(new_states)
+
+    progress.videos = len(video_files)
+    progress.unparsed = rule_counts.pop(None, 0)
+    progress.rule_counts = rule_counts
+    progress.state = 'done'
+    progress.finished_at = time.time()
+    logger.debug(f"Found {len(video_files)} video files in {library_path}"
+                 f" ({progress.unchanged} of {progress.directories} directories unchanged)")
     return video_files
 
 
-def parse_video_filename(filename: str) -> Dict:
-    """ Parse video filename to get [show name, season, episode] """
-    # regex patterns
-    patterns = [
-        r'(.+?)[\. ]S(\d{1,2})E(\d{1,2})',  # ShowName.S01E01
-        r'(.+?)[\. ](\d{1,2})x(\d{1,2})',    # ShowName.1x01
-        # ShowName.Season1Episode01 or ShowName Season 1 Episode 01 (maybe useless, the secure_filename will remove the spaces)
-        r'(.+?)[\. ]Season[\. ]?(\d{1,2})[\. ]?Episode[\. ]?(\d{1,2})',
-        # ShowName.Season1Episode01
-        r'(.+?)[\. ]Season(\d{1,2})Episode(\d{1,2})',
-        r'(.+?)[\. ]S(\d{1,2})\.E(\d{1,2})',  # ShowName.S01.E01
-        # ShowName_S01E01_Additional_Info
-        r'(.+?)[_\- ]S(\d{1,2})E(\d{1,2})[_\- ]'
-    ]
+def format_episode_label(info: Dict) -> str:
+    """ S01E01, S01E01-E02 for multi-episode files, S01 for season packs """
+    if info['episode'] is None:
+        return f"S{info['season']:02d}"
+    if info['episode_end'] != info['episode']:
+        return f"S{info['season']:02d}E{info['episode']:02d}-E{info['episode_end']:02d}"
+    return f"S{info['season']:02d}E{info['episode']:02d}"
 
+
+def parse_video_filename(filename: str) -> Dict:
+    """ Parse video filename to get [show name, season, episode (range)] with the active file name rules """
     original_name = filename
     filename = os.path.splitext(filename)[0]
 
     # Try direct matching first, without removing language codes
-    for pattern in patterns:
-        match = re.search(pattern, filename, re.IGNORECASE)  # case insensitive
-        if match:
-
-            # Align the show name with uploaded subtitle filename style
-            show_name = match.group(1).replace('.', ' ').strip()
-            secure_show_name = secure_filename(show_name)
-
-            # extract year
-            clean_show_name = re.sub(r'[^\w\s]', ' ', show_name) # remove special characters
-            year_re = re.search(r'(?<!\d)(\d{4})(?![\w])', show_name) # match 4 digits not preceded or followed by a digit
-            year = None
-            if year_re:
-                year = year_re.group(1)
-                clean_show_name = re.sub(r'\b' + year + r'\b', '', clean_show_name).strip() # remove year
-                clean_show_name = re.sub(r'\s+', ' ', clean_show_name).strip() # normalize spaces
-                
-            result = {
-                'show_name': show_name,
-                'secure_show_name': secure_show_name,
-                'clean_show_name': clean_show_name,
-                'season': int(match.group(2)),
-                'episode': int(match.group(3)),
-                'match_end': match.end(),   # end index of the match (for suffix parsing) TODO: remove this?
-                'suffix': filename[match.end():],
-                'original_name': original_name
-            }
-
-            if year:
-                result['year'] = year
+    match = get_filename_matcher().match(filename)
+    if match:
+        rule, matched_show, season, episode, episode_end, match_end = match
 
-            logger.debug(
-                f"✓ Pattern matched: {match.group(1).strip()} S{match.group(2)}E{match.group(3)}")
-            return result
+        # Align the show name with uploaded subtitle filename style
+        show_name = matched_show.replace('.', ' ').strip()
+        secure_show_name = secure_filename(show_name)
+
+        # extract year
+        clean_show_name = re.sub(r'[^\w\s]', ' ', show_name) # remove special characters
+        year_re = re.search(r'(?<!\d)(\d{4})(?![\w])', show_name) # match 4 digits not preceded or followed by a digit
+        year = None
+        if year_re:
+            year = year_re.group(1)
+            clean_show_name = re.sub(r'\b' + year + r'\b', '', clean_show_name).strip() # remove year
+            clean_show_name = re.sub(r'\s+', ' ', clean_show_name).strip() # normalize spaces
+
+        # Episode range: a single episode is [n, n], a season pack has no episode at all
+        result = {
+            'show_name': show_name,
+            'secure_show_name': secure_show_name,
+            'clean_show_name': clean_show_name,
+            'season': season,
+            'episode': episode,
+            'episode_end': episode_end,
+            'match_end': match_end,   # end index of the match (for suffix parsing) TODO: remove this?
+            'suffix': filename[match_end:],
+            'original_name': original_name,
+            'rule': rule
+        }
+
+        if year:
+            result['year'] = year
+
+        logger.debug(
+            f"✓ Pattern matched ({rule}): {matched_show.strip()} {format_episode_label(result)}")
+        return result
 
     logger.debug(f"✗ No pattern match for: {filename}")
     return None
 
 
-def match_subtitle_to_video(subtitle_info: Dict, video_files: List[Dict], threshold: int = 80) -> Dict:
-    """ Match subtitle file to the most appropriate video file """
+class EpisodeIntervals:
+    """ Episode ranges of the videos of one (show, season), sorted for O(log n) lookup """
+
+    def __init__(self):
+        self._intervals = []     # (first episode, last episode, scan order, video)
+        self._starts = []        # first episodes of self._intervals, for bisect
+        self._max_span = 0       # longest multi-episode range, bounds the backwards scan
+        self._season_wide = []   # videos named after the whole season (no episode number)
+        self._sorted = True
+
+    def add(self, video: VideoRecord, order: int) -> None:
+        if video.episode is None:
+            self._season_wide.append(video)
+            return
+        self._intervals.append((video.episode, video.episode_end, order, video))
+        self._max_span = max(self._max_span, video.episode_end - video.episode)
+        self._sorted = False
+
+    def find(self, first: int, last: int) -> VideoRecord:
+        """
+        Video whose episode range covers [first, last], preferring an exact range, then scan order.
+        A subtitle without an episode number (first is None) goes to the first video named after the whole season,
+        an episode subtitle never does: extras such as Show.S01.Featurette parse as season-wide videos too.
+        """
+        if first is None:
+            return self._season_wide[0] if self._season_wide else None
+        if not self._sorted:
+            self._intervals.sort(key=lambda interval: (interval[0], interval[2]))
+            self._starts = [interval[0] for interval in self._intervals]
+            self._sorted = True
+
+        best_rank = None
+        best_video = None
+        # Only intervals starting in [first - max_span, first] can cover first
+        i = bisect.bisect_right(self._starts, first) - 1
+        while i >= 0 and self._starts[i] >= first - self._max_span:
+            start, end, order, video = self._intervals[i]
+            if end >= last:
+                rank = (start != first or end != last, order)
+                if best_rank is None or rank < best_rank:
+                    best_rank = rank
+                    best_video = video
+            i -= 1
+        return best_video
+
+
+class VideoIndex:
+    """
+    Videos of a library grouped by show, then by season into episode intervals.
+    Library queries work on sets of video ids (positions in self.videos) per show, season and subtitle language.
+    """
+    ANY_LANGUAGE = '*'
+
+    def __init__(self, video_files: List[VideoRecord]):
+        # (clean show name, year) -> {season: EpisodeIntervals}
+        self.shows: Dict[tuple, Dict[int, EpisodeIntervals]] = {}
+        self.videos = video_files
+        self.video_count = len(video_files)
+        self.built_at = time.time()
+        self.show_videos: Dict[tuple, Set[int]] = {}
+        self.season_videos: Dict[int, Set[int]] = {}
+        self.language_videos: Dict[str, Set[int]] = {}  # sidecar language -> videos having it, '*' = any sidecar
+        self.directory_videos: Dict[str, List[int]] = {}
+        self.show_titles: Dict[str, List[tuple]] = {}   # normalized show title -> show keys (one per year)
+
+        for order, video in enumerate(video_files):
+            show_key = (video.clean_show_name.lower(), video.year)
+            seasons = self.shows.get(show_key)
+            if seasons is None:
+                seasons = self.shows[show_key] = {}
+                self.show_titles.setdefault(normalize_title(video.clean_show_name), []).append(show_key)
+            seasons.setdefault(video.season, EpisodeIntervals()).add(video, order)
+
+            self.show_videos.setdefault(show_key, set()).add(order)
+            self.season_videos.setdefault(video.season, set()).add(order)
+            self.directory_videos.setdefault(video.directory, []).append(order)
+            self._add_languages(order)
+
+        # Fingerprint of the video list, changes whenever a video is added, removed or renamed
+        digest = hashlib.sha1()
+        for full_path in sorted(video.full_path for video in video_files):
+            digest.update(full_path.encode('utf-8', 'surrogateescape'))
+            digest.update(b'\0')
+        self.generation = digest.hexdigest()[:16]
+
+    def _add_languages(self, video_id: int) -> None:
+        video = self.videos[video_id]
+        if video.subtitle_files:
+            self.language_videos.setdefault(self.ANY_LANGUAGE, set()).add(video_id)
+            for language in video.subtitle_languages:
+                self.language_videos.setdefault(language, set()).add(video_id)
+
+    def directory_sidecars(self, directory: str) -> Set[str]:
+        """ Sidecar subtitle names of the videos in a directory, as seen by the scan """
+        return {subtitle_file for video_id in self.directory_videos.get(directory, ())
+                for subtitle_file in self.videos[video_id].subtitle_files}
+
+    def refresh_sidecars(self, directory: str, file_names: List[str], subtitle_extensions: List[str]) -> None:
+        """ Re-assign the sidecar subtitles of the videos in a directory from a new listing of it """
+        video_ids = self.directory_videos.get(directory)
+        if not video_ids:
+            return
+        subtitles = [name for name in file_names if any(name.lower().endswith(ext) for ext in subtitle_extensions)]
+        sidecars = _match_sidecars([self.videos[video_id].file_name for video_id in video_ids], subtitles)
+        for video_id in video_ids:
+            video = self.videos[video_id]
+            for language in video.subtitle_languages | {self.ANY_LANGUAGE}:
+                self.language_videos.get(language, set()).discard(video_id)
+            video.subtitle_files = tuple(sidecars.get(video.file_name, ()))
+            self._add_languages(video_id)
+
+    def _sort_key(self, video_id: int) -> tuple:
+        video = self.videos[video_id]
+        return video.clean_show_name.lower(), video.year or '', video.season, video.episode or 0, video.file_name
+
+    def list_shows(self, show: str = None) -> List[Dict]:
+        """ Shows sorted by name, with their seasons and episode / subtitled counts """
+        subtitled = self.language_videos.get(self.ANY_LANGUAGE, set())
+        shows = []
+        for show_key in sorted(self.show_videos, key=lambda key: (key[0], key[1] or '')):
+            if show and show.lower() not in show_key[0]:
+                continue
+            video_ids = self.show_videos[show_key]
+            shows.append({
+                'show_name': self.videos[min(video_ids)].show_name,
+                'year': show_key[1],
+                'seasons': sorted(self.shows[show_key]),
+                'episodes': len(video_ids),
+                'subtitled': len(video_ids & subtitled)
+            })
+        return shows
+
+    def query_episodes(self, show: str = None, year: str = None, season: int = None,
+                       missing_language: str = None) -> List[VideoRecord]:
+        """
+        Videos of a show (exact clean name, case insensitive) / season, sorted by show, season and episode.
+        missing_language keeps only videos without a sidecar in that language ('*': without any sidecar).
+        """
+        if show is None:
+            video_ids = set(range(self.video_count))
+        else:
+            video_ids = set()
+            for (show_name, show_year), show_ids in self.show_videos.items():
+                if show_name == show.lower() and (year is None or show_year == year):
+                    video_ids |= show_ids
+        if season is not None:
+            video_ids &= self.season_videos.get(season, set())
+        if missing_language is not None:
+            video_ids -= self.language_videos.get(missing_language.lower(), set())
+        return [self.videos[video_id] for video_id in sorted(video_ids, key=self._sort_key)]
+
+
+def scan_library(library: Dict, config_manager: ConfigManager, directory_states: Dict[str, tuple] = None) -> VideoIndex:
+    """ Scan a configured library with its settings and index the videos (incrementally with directory_states) """
+    logger.debug(f"  → Scanning library: {library['library_name']}")
+    video_files = scan_media_library(
+        library['library_path'],
+        config_manager.video_extensions,
+        parse_workers=config_manager.parse_workers,
+        parallel_threshold=config_manager.parallel_parse_threshold,
+        max_concurrent_reads=library.get('max_concurrent_reads', 0),
+        max_entries_per_second=library.get('max_entries_per_second', 0),
+        subtitle_extensions=config_manager.subtitle_extensions,
+        directory_states=directory_states,
+        lock_dir=os.path.join(config_manager.temp_dir, 'io')
+    )
+    return VideoIndex(video_files)
+
+
+class LibraryIndexCache:
+    """
+    Library indexes kept across uploads by one process, rebuilt after ttl seconds.
+    Warm it before gunicorn forks (--preload) so workers share it copy-on-write,
+    or in a background thread so the first upload doesn't pay for a cold scan.
+    Rebuilds only re-read the directories whose mtime changed; with a snapshot_dir the directory states
+    are saved after each scan and loaded on first use, so a restart doesn't need a full scan either.
+    """
+
+    def __init__(self, ttl: int = 600, snapshot_dir: str = None):
+        self.ttl = ttl
+        self.snapshot_dir = snapshot_dir
+        self.ready = False
+        self._indexes: Dict[str, VideoIndex] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        self._routes: Dict[str, List[str]] = {}
+        self._routes_stamp = None
+        # library path -> (parse key, directory states of its last scan), see scan_media_library()
+        self._states: Dict[str, tuple] = {}
+
+    def _lock(self, library_path: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(library_path, threading.Lock())
+
+    @staticmethod
+    def _parse_key(config_manager: ConfigManager) -> str:
+        """ Settings the parsed directory states depend on, they are discarded when it changes """
+        install_filename_rules(config_manager.filename_patterns)
+        settings = [get_filename_matcher().user_rules, config_manager.video_extensions,
+                    config_manager.subtitle_extensions]
+        return hashlib.sha1(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+    def _load_states(self, library_path: str, key: str) -> Dict[str, tuple]:
+        """ Directory states from the library's snapshot, empty (full scan) without a usable one """
+        snapshot = read_snapshot(snapshot_path(self.snapshot_dir, library_path), library_path, key) \
+            if self.snapshot_dir else None
+        if snapshot is None:
+            return {}
+        header, rows = snapshot
+        states = {}
+        for directory, mtime, dirs, videos, rule_counts in rows:
+            directory = sys.intern(directory)
+            states[directory] = (mtime, tuple(dirs), tuple(VideoRecord.from_fields(directory, fields)
+                                                            for fields in videos), rule_counts)
+        logger.info(f"✓ Loaded index snapshot of {library_path} ({len(states)} directories, "
+                    f"{time.time() - header['created_at']:.0f} s old)")
+        return states
+
+    def _save_states(self, library_path: str, key: str, states: Dict[str, tuple]) -> None:
+        rows = [(directory, mtime, dirs, [video.to_fields() for video in videos], rule_counts)
+                for directory, (mtime, dirs, videos, rule_counts) in states.items()]
+        write_snapshot(snapshot_path(self.snapshot_dir, library_path), library_path, key, rows)
+
+    def get(self, library: Dict, config_manager: ConfigManager, refresh: bool = False) -> VideoIndex:
+        """ Index of the library, scanning it if missing, expired, parsed with other settings or refresh is set """
+        library_path = library['library_path']
+        key = self._parse_key(config_manager)
+        # One scan per library at a time, concurrent callers wait and reuse its result
+        with self._lock(library_path):
+            video_index = self._indexes.get(library_path)
+            states_key, states = self._states.get(library_path, (None, None))
+            if (refresh or video_index is None or time.time() - video_index.built_at > self.ttl
+                    or states_key != key):
+                if states_key != key:
+                    states = self._load_states(library_path, key)
+                previous = dict(states)
+                with get_stage_limiter('scanning', config_manager).slot():
+                    video_index = scan_library(library, config_manager, states)
+                self._indexes[library_path] = video_index
+                self._states[library_path] = (key, states)
+                # Unchanged directories keep their state objects, anything else is worth a new snapshot
+                if self.snapshot_dir and (len(states) != len(previous)
+                                          or any(previous.get(directory) is not state
+                                                 for directory, state in states.items())):
+                    self._save_states(library_path, key, states)
+            return video_index
+
+    def routes(self, libraries: List[Dict], config_manager: ConfigManager) -> Dict[str, List[str]]:
+        """
+        Show routing table: normalized show title -> paths of the libraries holding that show (in configured order).
+        Rebuilt only when one of the library indexes has been rebuilt.
+        """
+        indexes = [(library['library_path'], self.get(library, config_manager)) for library in libraries]
+        stamp = tuple((library_path, video_index.built_at) for library_path, video_index in indexes)
+        if stamp != self._routes_stamp:
+            routes = {}
+            for library_path, video_index in indexes:
+                for title in video_index.show_titles:
+                    routes.setdefault(title, []).append(library_path)
+            self._routes, self._routes_stamp = routes, stamp
+        return self._routes
+
+    def peek(self, library_path: str) -> VideoIndex:
+        """ Index of the library if one is cached (even expired), never scans """
+        return self._indexes.get(library_path)
+
+    def warm(self, config_manager: ConfigManager) -> None:
+        """ Index every configured library now """
+        for library in config_manager.media_libraries:
+            try:
+                self.get(library, config_manager)
+            except Exception as e:
+                logger.error(f"Error indexing library {library['library_name']}: {str(e)}")
+        self.ready = True
+        logger.info("Library index ready")
+
+    def warm_in_background(self, config_manager: ConfigManager) -> threading.Thread:
+        thread = threading.Thread(target=self.warm, args=(config_manager,), name='library-index-warmup', daemon=True)
+        thread.start()
+        return thread
+
+    def status(self) -> List[Dict]:
+        return [{'library_path': library_path,
+                 'videos': video_index.video_count,
+                 'age_s': round(time.time() - video_index.built_at, 1)}
+                for library_path, video_index in list(self._indexes.items())]
+
+
+def _match_exact_title(subtitle_info: Dict, video_index: VideoIndex, title: str) -> tuple:
+    """ (video, score) of the show with exactly this normalized title, (None, 0) if it lacks the episode """
+    best_match = None
+    highest_score = 0
+    for show_key in video_index.show_titles.get(title, ()):
+        intervals = video_index.shows[show_key].get(subtitle_info['season'])
+        video = intervals.find(subtitle_info['episode'], subtitle_info['episode_end']) if intervals else None
+        if not video:
+            continue
+        score = 100
+        if 'year' in subtitle_info and show_key[1] and subtitle_info['year'] == show_key[1]:
+            score += 10  # same boost as the fuzzy match
+        if score > highest_score:
+            highest_score = score
+            best_match = video
+    return best_match, highest_score
+
+
+def match_subtitle_to_video(subtitle_info: Dict, video_files: Union[List[VideoRecord], VideoIndex], threshold: int = 80,
+                            aliases: TitleAliases = None) -> Dict:
+    """
+    Match subtitle file to the most appropriate video file.
+    Titles known to the library (directly or through the alias table) resolve with a hash lookup,
+    fuzzy scoring over all shows is the fallback.
+    """
     if not subtitle_info:
         logger.debug(f"✗ Could not parse subtitle info")
         return None
 
     logger.debug(f"→ Processing: {subtitle_info['original_name']}")
     logger.debug(
-        f"  Show: {subtitle_info['show_name']}, S{subtitle_info['season']:02d}E{subtitle_info['episode']:02d}")
+        f"  Show: {subtitle_info['show_name']}, {format_episode_label(subtitle_info)}")
+
+    if subtitle_info['episode'] is None:
+        logger.info(f"✗ Season pack name without episode number, cannot place a single subtitle")
+        return None
+
+    video_index = video_files if isinstance(video_files, VideoIndex) else VideoIndex(video_files)
+
+    # Exact title first, then its alias (e.g. a Chinese fansub title for an English library folder)
+    title = normalize_title(subtitle_info['clean_show_name'])
+    alias = aliases.lookup(title) if aliases else None
+    for candidate in (title, alias):
+        if not candidate:
+            continue
+        best_match, highest_score = _match_exact_title(subtitle_info, video_index, candidate)
+        if best_match:
+            if candidate is alias:
+                logger.debug(f"  → Title alias: {subtitle_info['clean_show_name']} -> {alias}")
+            logger.info(
+                f"✓ Matched: {best_match.file_name} (score: {highest_score})")
+            best_match = best_match.to_dict()
+            best_match['match_score'] = highest_score  # append match score
+            return best_match
+
+    from fuzzywuzzy import fuzz
 
     best_match = None
     highest_score = 0
+    subtitle_show_name = subtitle_info['clean_show_name'].lower()
 
-    for video in video_files:
+    for (video_show_name, video_year), seasons in video_index.shows.items():
 
-        # First check if season and episode match (exact match)
-        if (subtitle_info['season'] == video['season'] and
-                subtitle_info['episode'] == video['episode']):
+        # First find the video covering the season and episode range (exact match)
+        intervals = seasons.get(subtitle_info['season'])
+        if not intervals:
+            continue
+        video = intervals.find(subtitle_info['episode'], subtitle_info['episode_end'])
+        if not video:
+            continue
 
-            # Then check show name similarity (fuzzy match)
-            # score = fuzz.ratio(subtitle_info['show_name'].lower(), video['secure_show_name'].lower())
-            score = fuzz.ratio(subtitle_info['clean_show_name'].lower(), video['clean_show_name'].lower())
-            # Other fuzzy match functions: partial_ratio, token_sort_ratio, token_set_ratio
+        # Then check show name similarity (fuzzy match)
+        score = fuzz.ratio(subtitle_show_name, video_show_name)
+        # Other fuzzy match functions: partial_ratio, token_sort_ratio, token_set_ratio
 
-            # if Year exists, increase score if year matches
-            if 'year' in subtitle_info and 'year' in video:
-                if subtitle_info['year'] == video['year']:
-                    score += 10  # boost score by 10 if year matches
-                    logger.debug(f"  → Year matched: {subtitle_info['year']}")
+        # if Year exists, increase score if year matches
+        if 'year' in subtitle_info and video_year:
+            if subtitle_info['year'] == video_year:
+                score += 10  # boost score by 10 if year matches
+                logger.debug(f"  → Year matched: {subtitle_info['year']}")
 
-            logger.debug(
-                f"  → SubtitleName 「{subtitle_info['clean_show_name']}」 vs VideoName 「{video['clean_show_name']}」: {score}")
+        logger.debug(
+            f"  → SubtitleName 「{subtitle_info['clean_show_name']}」 vs VideoName 「{video.clean_show_name}」: {score}")
 
-            if score > highest_score and score >= threshold:
-                highest_score = score
-                best_match = video
-                best_match['match_score'] = score  # append match score
+        if score > highest_score and score >= threshold:
+            highest_score = score
+            best_match = video
 
     if best_match:
         logger.info(
-            f"✓ Matched: {os.path.basename(best_match['full_path'])} (score: {highest_score})")
+            f"✓ Matched: {best_match.file_name} (score: {highest_score})")
+        best_match = best_match.to_dict()
+        best_match['match_score'] = highest_score  # append match score
     else:
         logger.info(f"✗ No matching video found")
 
     return best_match
 
 
-def process_subtitle_file(file_path: str, config_manager: ConfigManager, lang_suffix: str = "", overwrite: bool = False) -> List[Dict]:
-    """ Process subtitle file or pack and match with video files """
-    results = []
+def find_best_match(subtitle_info: Dict, libraries: List[Dict], config_manager: ConfigManager,
+                    index_cache: LibraryIndexCache, aliases: TitleAliases = None) -> tuple:
+    """
+    (library, video index, matched video) with the best score over all libraries, None if nothing matches.
+    The routing table sends a known show title (or its alias) straight to the libraries holding it,
+    the other libraries are only fuzzy matched when those have no exact title match (score 100) for the episode.
+    On equal scores the library configured first wins.
+    """
+    routes = index_cache.routes(libraries, config_manager)
+    title = normalize_title(subtitle_info['clean_show_name'])
+    alias = aliases.lookup(title) if aliases else None
+    routed = set(routes.get(title, [])) | set(routes.get(alias, []) if alias else [])
+
+    routed_libraries = [library for library in libraries if library['library_path'] in routed]
+    other_libraries = [library for library in libraries if library['library_path'] not in routed]
+    order = {library['library_path']: position for position, library in enumerate(libraries)}
+    best = None
+    for candidates in (routed_libraries, other_libraries):
+        for library in candidates:
+            video_index = index_cache.get(library, config_manager)
+            matched_video = match_subtitle_to_video(subtitle_info, video_index, aliases=aliases)
+            if matched_video and (best is None or matched_video['match_score'] > best[2]['match_score']
+                                  or (matched_video['match_score'] == best[2]['match_score']
+                                      and order[library['library_path']] < order[best[0]['library_path']])):
+                best = (library, video_index, matched_video)
+        # An exact title match in a routed library can't be beaten, a fuzzy one may be by another library
+        if best and best[2]['match_score'] >= 100:
+            break
+    if best and len(libraries) > 1:
+        logger.debug(f"  → Best match in library: {best[0]['library_name']}")
+    return best
+
+
+def place_subtitle_file(subtitle_file: str, dest_path: str, normalize_encoding: bool = False,
+                        convert_to_srt: bool = False, time_offset_ms: int = 0, framerate_ratio: float = 1.0) -> None:
+    """ Move the subtitle file to its destination, running the optional conversion stages on the way """
+    # Retime in the temp dir first, so the library only ever sees the finished file
+    if time_offset_ms or framerate_ratio != 1.0:
+        if os.path.splitext(subtitle_file)[1].lower() in ASS_EXTENSIONS | {'.srt'}:
+            encoding = detect_encoding(subtitle_file)
+            if encoding is None:
+                logger.debug("  → Unknown encoding, retiming without touching the text")
+            cue_count = retime_subtitle(subtitle_file, subtitle_file, time_offset_ms, framerate_ratio, encoding)
+            logger.debug(f"  → Retimed {cue_count} cues (offset: {time_offset_ms} ms, ratio: {framerate_ratio:.6f})")
+        else:
+            logger.warning(f"  ! Retiming not supported, keeping original timing: {os.path.basename(subtitle_file)}")
+
+    if convert_to_srt and os.path.splitext(subtitle_file)[1].lower() in ASS_EXTENSIONS:
+        encoding = detect_encoding(subtitle_file)
+        if encoding is None:
+            # The destination already has the .srt name, the caller checks the encoding before naming it
+            raise ValueError(f"Unknown encoding, cannot convert to SRT: {os.path.basename(subtitle_file)}")
+        cue_count = convert_ass_to_srt(subtitle_file, dest_path, encoding)
+        logger.debug(f"  → Converted to SRT ({cue_count} cues)")
+        os.remove(subtitle_file)
+        return
+
+    if normalize_encoding:
+        encoding = detect_encoding(subtitle_file)
+        if encoding is None:
+            logger.warning(f"  ! Unknown encoding, keeping original bytes: {os.path.basename(subtitle_file)}")
+        elif encoding != 'utf-8':
+            logger.debug(f"  → Transcoding {encoding} to UTF-8")
+            transcode_to_utf8(subtitle_file, dest_path, encoding)
+            os.remove(subtitle_file)
+            return
+
+    shutil.move(subtitle_file, dest_path)
+
+
+class DestinationListing:
+    """
+    Existing file names of the destination directories of one batch, so overwrite / skip is decided in memory.
+    A directory comes from the scan's sidecar names when the library was scanned during this batch and the
+    name would be one of them (<video stem>.<language>.<ext>), otherwise it is listed once;
+    files placed by the batch are added as they are written.
+    Metadata round trips are proportional to the destination directories, not to the subtitle files.
+    """
+
+    def __init__(self, subtitle_extensions: List[str], batch_started: float):
+        self._subtitle_extensions = tuple(ext.lower() for ext in subtitle_extensions)
+        self._batch_started = batch_started
+        self._names: Dict[str, Set[str]] = {}
+        self._listed: Set[str] = set()               # read from disk, the others come from a scan
+        self._scanned_videos: Dict[str, List[str]] = {}  # video file names of the directories from a scan
+        self._written: Dict[str, VideoIndex] = {}    # destination directory -> index holding its videos
+        self.round_trips = 0
+
+    def _list(self, directory: str) -> Set[str]:
+        self.round_trips += 1
+        try:
+            return set(os.listdir(directory))
+        except OSError:
+            return set()
 
+    def exists(self, directory: str, name: str, video_index: VideoIndex = None) -> bool:
+        if directory not in self._names and video_index is not None and video_index.built_at >= self._batch_started:
+            self._names[directory] = video_index.directory_sidecars(directory)
+            self._scanned_videos[directory] = [video_index.videos[video_id].file_name
+                                               for video_id in video_index.directory_videos.get(directory, ())]
+        # The scan only recorded sidecar subtitles of its videos, any other name needs the real listing
+        if directory not in self._listed and (directory not in self._names
+                                              or not name.lower().endswith(self._subtitle_extensions)
+                                              or not _match_sidecars(self._scanned_videos.get(directory, []), [name])):
+            self._names[directory] = self._list(directory) | self._names.get(directory, set())
+            self._listed.add(directory)
+        return name in self._names[directory]
+
+    def add(self, directory: str, name: str, video_index: VideoIndex = None) -> None:
+        self._names.setdefault(directory, set()).add(name)
+        if directory not in self._written or video_index is not None:
+            self._written[directory] = video_index
+
+    def refresh_indexes(self) -> None:
+        """ List each written directory once and update the sidecars of its videos in the library index """
+        for directory, video_index in self._written.items():
+            if video_index is not None:
+                video_index.refresh_sidecars(directory, list(self._list(directory)), self._subtitle_extensions)
+        logger.debug(f"Destination directories: {len(self._written)} written, {self.round_trips} listings")
+        self._written.clear()
+
+
+def _skipped_member(subtitle_file: str, subtitle_name: str, file_path: str, reason: str,
+                    unmatched_dir: str = None) -> Dict:
+    """ Skipped event of a subtitle, moving it to unmatched_dir first if it was extracted from a pack """
+    event = {'event': 'skipped', 'subtitle_file': subtitle_name, 'reason': reason}
+    if unmatched_dir and subtitle_file != file_path:
+        os.makedirs(unmatched_dir, exist_ok=True)
+        dest_path = os.path.join(unmatched_dir, event['subtitle_file'])
+        if os.path.exists(dest_path):  # same member name in two nested packs
+            name, ext = os.path.splitext(event['subtitle_file'])
+            dest_path = os.path.join(unmatched_dir, f"{name}.{time.strftime('%Y%m%d-%H%M%S')}{ext}")
+        shutil.move(subtitle_file, dest_path)
+        event['set_aside'] = dest_path
+    return event
+
+
+def process_subtitle_file_events(file_path: str, config_manager: ConfigManager, lang_suffix: str = "",
+                                 overwrite: bool = False, normalize_encoding: bool = False,
+                                 convert_to_srt: bool = False, time_offset_ms: int = 0, framerate_ratio: float = 1.0,
+                                 match_cache: MatchCache = None, index_cache: LibraryIndexCache = None,
+                                 batch_started: float = None, title_aliases: TitleAliases = None,
+                                 unmatched_dir: str = None, source_name: str = None) -> Iterator[Dict]:
+    """
+    Process subtitle file or pack and match with video files, yielding an event per step:
+        extracted {count}, parsed {subtitle_file, show_name, episode}, matched {..., matched_video, match_score},
+        moved {result} (Moved / Overwritten), skipped {subtitle_file, reason, [result], [set_aside]}, done {count}
+    Files of one batch pass the batch start time, so an index scanned for the batch is never rescanned.
+    With unmatched_dir, pack members skipped as unparsed / unmatched are moved there (set_aside = their new path).
+    source_name is the original (Unicode) name of an uploaded subtitle file stored under a sanitized temp name,
+    it is the name that gets parsed (绝命毒师.S01E01.简体.ass instead of S01E01.ass).
+    """
     # Get extensions from config manager
     subtitle_exts = set(config_manager.subtitle_extensions)
     subtitle_pack_exts = set(config_manager.subtitle_pack_extensions)
 
     file_ext = os.path.splitext(file_path)[1].lower()
     subtitle_files = []
+    extract_dir = None   # folder of the extracted pack, removed with whatever is left in it once done
 
     logger.debug(f"→ Processing: {file_path}")
 
     # Handle subtitle pack
     if file_ext in subtitle_pack_exts:
         logger.debug(f"→ Extracting subtitle pack: {file_path}")
-        subtitle_files.extend(
-            extract_subtitle_pack(
-                file_path, config_manager.temp_dir, config_manager.subtitle_extensions)
-        )
+        with get_stage_limiter('extraction', config_manager).slot():
+            os.makedirs(config_manager.temp_dir, exist_ok=True)
+            extract_dir = tempfile.mkdtemp(prefix='pack_', dir=config_manager.temp_dir)
+            subtitle_files.extend(
+                extract_subtitle_pack(
+                    file_path, config_manager.temp_dir, config_manager.subtitle_extensions,
+                    pack_extensions=config_manager.subtitle_pack_extensions,
+                    max_depth=config_manager.archive_max_depth,
+                    max_total_bytes=config_manager.archive_max_total_bytes,
+                    max_files=config_manager.archive_max_files,
+                    extract_dir=extract_dir)
+            )
     # Handle single subtitle file
     elif file_ext in subtitle_exts:
         subtitle_files.append(file_path)
@@ -215,78 +1079,183 @@ def process_subtitle_file(file_path: str, config_manager: ConfigManager, lang_su
         logger.error(error_msg)
         raise ValueError(error_msg)
 
+    install_filename_rules(config_manager.filename_patterns)
+
+    # Without a shared cache each library is scanned at most once per upload, on first use
+    index_cache = index_cache or LibraryIndexCache()
+    upload_started = batch_started or time.time()
+    rescanned_libraries = set()
+    library_paths = [library['library_path'] for library in config_manager.media_libraries]
+    destinations = DestinationListing(config_manager.subtitle_extensions, upload_started)
+    language_tokens = get_language_tokens(config_manager.language_tokens)
+
     # Process each subtitle file
-    for subtitle_file in subtitle_files:
-        logger.debug(
-            f"→ Processing subtitle: {os.path.basename(subtitle_file)}")
+    result_count = 0
+    # The match cache is saved and the pack folder removed even if the consumer stops early (e.g. a closed event stream)
+    try:
+        yield {'event': 'extracted', 'count': len(subtitle_files)}
+        for subtitle_file in subtitle_files:
+            subtitle_name = source_name if source_name and subtitle_file == file_path else os.path.basename(subtitle_file)
+            logger.debug(
+                f"→ Processing subtitle: {subtitle_name}")
         
-        # get the subtitle info
-        subtitle_info = parse_video_filename(os.path.basename(subtitle_file))
-        if not subtitle_info:
-            logger.debug(f"✗ Could not parse subtitle file: {subtitle_file}")
-            continue
+            # get the subtitle info
+            subtitle_info = parse_video_filename(subtitle_name)
+            if not subtitle_info:
+                logger.debug(f"✗ Could not parse subtitle file: {subtitle_file}")
+                yield _skipped_member(subtitle_file, subtitle_name, file_path, 'unparsed', unmatched_dir)
+                continue
+            # Language token after the episode (Show.S01E01.chs&eng.ass -> zh-CN.en), same regex pass for all tokens
+            language = language_tokens.suffix_for(subtitle_info['suffix'])
+            yield {'event': 'parsed', 'subtitle_file': subtitle_name, 'show_name': subtitle_info['show_name'],
+                   'episode': format_episode_label(subtitle_info), 'language': language}
 
-        for library in config_manager.media_libraries:
-            logger.debug(f"  → Scanning library: {library['library_name']}")
-
-            # Scan video files in the library
-            video_files = scan_media_library(
-                library['library_path'],
-                config_manager.video_extensions
-            )
+            # Repeat uploads of the same subtitle resolve from the cache without any scan
+            cached = match_cache.get(subtitle_info, library_paths) if match_cache else None
+            if cached:
+                logger.info(
+                    f"✓ Matched (cached): {os.path.basename(cached['video_path'])} (score: {cached['score']})")
+                libraries = [library for library in config_manager.media_libraries
+                             if library['library_path'] == cached['library_path']]
+            else:
+                # Try to match subtitle with video, the best score over all libraries wins
+                best = find_best_match(subtitle_info, config_manager.media_libraries, config_manager,
+                                       index_cache, title_aliases)
 
-            # Try to match subtitle with video
-            matched_video = match_subtitle_to_video(subtitle_info, video_files)
+                # Indexes built before this upload may miss newly added episodes, rescan them once
+                if not best:
+                    stale_libraries = [library for library in config_manager.media_libraries
+                                       if library['library_path'] not in rescanned_libraries
+                                       and index_cache.get(library, config_manager).built_at < upload_started]
+                    for library in stale_libraries:
+                        rescanned_libraries.add(library['library_path'])
+                        index_cache.get(library, config_manager, refresh=True)
+                    if stale_libraries:
+                        best = find_best_match(subtitle_info, config_manager.media_libraries, config_manager,
+                                               index_cache, title_aliases)
 
-            if matched_video:
-                # Create destination path
-                video_dir = os.path.dirname(matched_video['full_path'])
-                video_name = os.path.splitext(
-                    os.path.basename(matched_video['full_path']))[0]
-                subtitle_ext = os.path.splitext(subtitle_file)[1]
+                if match_cache:
+                    for library in config_manager.media_libraries:
+                        match_cache.record_scan(library['library_path'],
+                                                index_cache.get(library, config_manager).generation)
+                libraries = [best[0]] if best else []
 
-                if lang_suffix == "*":
-                    # Use the suffix from subtitle_info directly
-                    new_subtitle_name = f"{video_name}{subtitle_info['suffix']}{subtitle_ext}"
-                    logger.debug(f"  → Using original suffix: {subtitle_info['suffix']}")
+            for library in libraries:
+                if cached:
+                    matched_video = {'full_path': cached['video_path'], 'match_score': cached['score']}
+                    video_index = index_cache.peek(library['library_path'])
                 else:
-                    suffix = f".{lang_suffix}" if lang_suffix else ""
-                    new_subtitle_name = f"{video_name}{suffix}{subtitle_ext}"
-                    logger.debug(f"  → Using language suffix: {suffix}")
-
-                dest_path = os.path.join(video_dir, new_subtitle_name)
-
-                status = 'Failed'
-                # Check if destination file already exists
-                if os.path.exists(dest_path):
-                    if overwrite:
-                        status = 'Overwritten'
-                        logger.info(
-                            f"! Overwriting: {os.path.basename(dest_path)}")
-                        # Delete the original subtitle file
-                        shutil.move(subtitle_file, dest_path)
+                    _, video_index, matched_video = best
+                    if match_cache:
+                        match_cache.put(subtitle_info, library_paths, library['library_path'],
+                                        matched_video['full_path'], matched_video['match_score'])
+
+                if matched_video:
+                    yield {'event': 'matched', 'subtitle_file': subtitle_name,
+                           'matched_video': os.path.basename(matched_video['full_path']),
+                           'match_score': matched_video['match_score'], 'cached': bool(cached)}
+
+                    # Create destination path
+                    video_dir = os.path.dirname(matched_video['full_path'])
+                    video_name = os.path.splitext(
+                        os.path.basename(matched_video['full_path']))[0]
+                    subtitle_ext = os.path.splitext(subtitle_file)[1]
+                    convert_file = convert_to_srt and subtitle_ext.lower() in ASS_EXTENSIONS
+                    if convert_file and detect_encoding(subtitle_file) is None:
+                        # Same as normalize_encoding: never guess, placed as it is under its own extension
+                        logger.warning(f"  ! Unknown encoding, keeping the ASS file: {subtitle_name}")
+                        convert_file = False
+                    if convert_file:
+                        subtitle_ext = '.srt'
+
+                    if lang_suffix == "*":
+                        # Use the suffix from subtitle_info directly
+                        new_subtitle_name = f"{video_name}{subtitle_info['suffix']}{subtitle_ext}"
+                        logger.debug(f"  → Using original suffix: {subtitle_info['suffix']}")
+                    elif language:
+                        # Multi-language packs fan out to one destination per language
+                        new_subtitle_name = f"{video_name}.{language}{subtitle_ext}"
+                        logger.debug(f"  → Using language token suffix: .{language}")
                     else:
-                        status = 'Skipped'
-                        logger.info(
-                            f"✗ Skipping: {os.path.basename(subtitle_file)} (already exists)")
+                        suffix = f".{lang_suffix}" if lang_suffix else ""
+                        new_subtitle_name = f"{video_name}{suffix}{subtitle_ext}"
+                        logger.debug(f"  → Using language suffix: {suffix}")
+
+                    dest_path = os.path.join(video_dir, new_subtitle_name)
+
+                    status = 'Failed'
+                    # Check if destination file already exists (from the scan / one listing per directory)
+                    if destinations.exists(video_dir, new_subtitle_name, video_index):
+                        if overwrite:
+                            status = 'Overwritten'
+                            logger.info(
+                                f"! Overwriting: {os.path.basename(dest_path)}")
+                            # Delete the original subtitle file
+                            with get_stage_limiter('moving', config_manager).slot():
+                                place_subtitle_file(subtitle_file, dest_path, normalize_encoding, convert_file,
+                                                    time_offset_ms, framerate_ratio)
+                        else:
+                            status = 'Skipped'
+                            logger.info(
+                                f"✗ Skipping: {os.path.basename(subtitle_file)} (already exists)")
+                            # Delete the original subtitle file
+                            os.remove(subtitle_file)
+
+                    else:
+                        status = 'Moved'
+                        logger.info(f"  → Moving to: {dest_path}")
                         # Delete the original subtitle file
-                        os.remove(subtitle_file)
+                        with get_stage_limiter('moving', config_manager).slot():
+                            place_subtitle_file(subtitle_file, dest_path, normalize_encoding, convert_file,
+                                                time_offset_ms, framerate_ratio)
+
+                    if status != 'Skipped':
+                        destinations.add(video_dir, new_subtitle_name, video_index)
+                        # A placed match confirms the title, next time it resolves without fuzzy scoring
+                        if title_aliases and not cached:
+                            title_aliases.learn(subtitle_info['clean_show_name'], matched_video['clean_show_name'])
+
+                    result = {
+                        'status': status,
+                        'subtitle_file': subtitle_name,
+                        'matched_video': os.path.basename(matched_video['full_path']),
+                        'destination': os.path.basename(dest_path),
+                        'match_score': matched_video['match_score']
+                    }
+                    result_count += 1
+                    if status == 'Skipped':
+                        yield {'event': 'skipped', 'subtitle_file': subtitle_name, 'reason': 'exists', 'result': result}
+                    else:
+                        yield {'event': 'moved', 'subtitle_file': subtitle_name, 'result': result}
+                    break
+            else:
+                yield _skipped_member(subtitle_file, subtitle_name, file_path, 'unmatched', unmatched_dir)
+    finally:
+        destinations.refresh_indexes()
+        if match_cache:
+            match_cache.save(library_paths)
+        if title_aliases:
+            title_aliases.save()
+        if extract_dir:
+            shutil.rmtree(extract_dir, ignore_errors=True)
+
+    yield {'event': 'done', 'count': result_count}
 
-                else:
-                    status = 'Moved'
-                    logger.info(f"  → Moving to: {dest_path}")
-                    # Delete the original subtitle file
-                    shutil.move(subtitle_file, dest_path)
-
-                results.append({
-                    'status': status,
-                    'subtitle_file': os.path.basename(subtitle_file),
-                    'matched_video': os.path.basename(matched_video['full_path']),
-                    'destination': os.path.basename(dest_path),
-                    'match_score': matched_video['match_score']
-                })
-                break  # Stop searching other libraries once we find a match
 
+def process_subtitle_file(file_path: str, config_manager: ConfigManager, lang_suffix: str = "", overwrite: bool = False,
+                          normalize_encoding: bool = False, convert_to_srt: bool = False,
+                          time_offset_ms: int = 0, framerate_ratio: float = 1.0,
+                          match_cache: MatchCache = None, index_cache: LibraryIndexCache = None,
+                          batch_started: float = None, title_aliases: TitleAliases = None,
+                          source_name: str = None) -> List[Dict]:
+    """ Process subtitle file or pack and match with video files, return the placement results """
+    results = []
+    for event in process_subtitle_file_events(file_path, config_manager, lang_suffix, overwrite,
+                                              normalize_encoding, convert_to_srt, time_offset_ms, framerate_ratio,
+                                              match_cache, index_cache, batch_started, title_aliases,
+                                              source_name=source_name):
+        if 'result' in event:
+            results.append(event['result'])
     return results
 
 if __name__ == '__main__':
@@ -294,6 +1263,8 @@ if __name__ == '__main__':
     test_subtitle_filename = "Slow.Horses.S04E06.Hello.Goodbye.2160p.ATVP.WEB-DL.DDP5.1.H.265-NTb.ass"
     test_video_filename = "Slow Horses (2022) - S04E06 - Hello Goodbye (1080p ATVP WEB-DL x265 Ghost).mkv"
 
+    from fuzzywuzzy import fuzz
+
     secure_subtitle_name = secure_filename(test_subtitle_filename)
 
     print(f"Secure Subtitle Name: {secure_subtitle_name}")
@@ -0,0 +1,59 @@
+"""
+    Opt-in profiling of single requests
+    A profiled call runs under cProfile and tracemalloc; the .pstats file and the top allocation sites
+    are stored in the profiles directory, named <time>-<label>. Nothing here runs for normal requests.
+"""
+from typing import Callable, Dict, List, Tuple
+import os
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+TOP_ALLOCATIONS = 30  # allocation sites written per profile
+
+
+def run_profiled(profiles_dir: str, label: str, func: Callable, *args, **kwargs) -> Tuple[object, str]:
+    """ Call func under cProfile and tracemalloc, return (its result, profile name) """
+    import cProfile
+    import tracemalloc
+    from werkzeug.utils import secure_filename
+
+    os.makedirs(profiles_dir, exist_ok=True)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{secure_filename(label) or 'request'}"
+
+    already_tracing = tracemalloc.is_tracing()
+    if not already_tracing:
+        tracemalloc.start()
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    try:
+        result = profiler.runcall(func, *args, **kwargs)
+    finally:
+        elapsed = time.perf_counter() - started
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        if not already_tracing:
+            tracemalloc.stop()
+
+        profiler.dump_stats(os.path.join(profiles_dir, f"{name}.pstats"))
+        with open(os.path.join(profiles_dir, f"{name}.allocations.txt"), 'w', encoding='utf-8') as f:
+            f.write(f"{label}: {elapsed:.3f} s, peak traced memory {peak / 1024:.1f} KiB\n\n")
+            for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]:
+                f.write(f"{stat}\n")
+        logger.info(f"✓ Profile saved: {name} ({elapsed:.3f} s)")
+
+    return result, name
+
+
+def list_profiles(profiles_dir: str) -> List[Dict]:
+    """ Stored profile files, newest first """
+    if not os.path.isdir(profiles_dir):
+        return []
+    profiles = []
+    for entry in os.scandir(profiles_dir):
+        if entry.is_file() and entry.name.endswith(('.pstats', '.allocations.txt')):
+            stat = entry.stat()
+            profiles.append({'file': entry.name, 'size': stat.st_size, 'created_at': stat.st_mtime})
+    return sorted(profiles, key=lambda profile: profile['created_at'], reverse=True)
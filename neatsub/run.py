@@ -1,9 +1,24 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory, stream_with_context
 import os
+import sys
+import json
+import hmac
+import math
+import threading
+import secrets
 import logging
+import unicodedata
 from werkzeug.utils import secure_filename
-from neatsub import process_subtitle_file
+from neatsub import process_subtitle_file, process_subtitle_file_events, LibraryIndexCache
 from config_manager import ConfigManager
+from match_cache import MatchCache
+from title_aliases import TitleAliases
+from io_throttle import get_scan_progress
+from chunked_upload import ChunkedUploadStore, ChunkedUploadError
+from watch_folder import run_watch_daemon
+from profiling import run_profiled, list_profiles
+from filename_patterns import get_filename_matcher, install_filename_rules, validate_rule
+from stage_limits import StageBusyError, check_stages, get_stage_status
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -17,9 +32,51 @@ config_manager = ConfigManager(CONFIG_FILE)
 logger.info(f"Loaded config from {CONFIG_FILE}")
 logger.info(f"Current Config: {config_manager.get_config_info()}")
 
+# Match results survive restarts, shared by all workers through the cache file
+match_cache = MatchCache(config_manager.match_cache_path)
+# User-edited and learned show title aliases, reloaded when the file changes
+title_aliases = TitleAliases(config_manager.title_aliases_path)
+
 # Ensure temp directory exists
 os.makedirs(config_manager.temp_dir, exist_ok=True)
 
+# Partial chunked uploads are kept on disk, any worker can resume them
+upload_store = ChunkedUploadStore(config_manager.temp_dir, config_manager.upload_max_bytes,
+                                  config_manager.upload_expiry)
+
+# Library indexes are reused across uploads. NEATSUB_INDEX_WARMUP:
+#   preload    - index now; with `gunicorn --preload` the forked workers share it copy-on-write
+#   background - index in a thread of each worker, uploads can be served meanwhile (default). Started after
+#                the fork (gunicorn.conf.py post_fork, or the worker's first request): threads don't survive
+#                fork, and a scan interrupted by it would leave its library lock held in every worker
+#   off        - index lazily on the first upload
+# Rebuilds read only the directories changed since the last scan, whose state is also kept in
+# index_snapshot_dir so a restarted container starts from its last snapshot instead of a full scan
+index_cache = LibraryIndexCache(config_manager.library_index_ttl, config_manager.index_snapshot_path)
+# `python run.py --watch` runs the watch-folder daemon instead of the web server, it scans per batch
+WATCH_MODE = __name__ == '__main__' and '--watch' in sys.argv[1:]
+INDEX_WARMUP = 'off' if WATCH_MODE else os.environ.get('NEATSUB_INDEX_WARMUP', 'background').lower()
+if INDEX_WARMUP == 'preload':
+    index_cache.warm(config_manager)
+elif INDEX_WARMUP != 'background':
+    index_cache.ready = True
+
+_warmup_pid = None
+_warmup_lock = threading.Lock()
+
+def start_index_warmup():
+    """ Start the background index warmup once per process (gunicorn worker or development server) """
+    global _warmup_pid
+    with _warmup_lock:
+        if INDEX_WARMUP == 'background' and _warmup_pid != os.getpid():
+            _warmup_pid = os.getpid()
+            index_cache.warm_in_background(config_manager)
+
+@app.before_request
+def warm_index_on_first_request():
+    # Fallback for servers without the gunicorn post_fork hook
+    start_index_warmup()
+
 def allowed_file(filename, allowed_extensions):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
 
@@ -27,48 +84,390 @@ def allowed_file(filename, allowed_extensions):
 def index():
     return send_from_directory('static', 'index.html')
 
-@app.route('/upload', methods=['POST'])
-def upload_subtitle():
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file part'}), 400
-    
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
-
+def parse_upload_options():
+    """
+    Processing options of an upload request (form fields)
+    Returns (options, None) or (None, error response)
+    """
     # Get parameters from request
     lang_suffix = request.form.get('lang_suffix', '')  # Empty string by default
     overwrite = request.form.get('overwrite', '').lower() == 'true'  # False by default
+    normalize_encoding = request.form.get('normalize_encoding', '').lower() == 'true'  # False by default
+    convert_to_srt = request.form.get('convert_to_srt', '').lower() == 'true'  # False by default
+
+    # Retiming: constant offset (ms) and / or framerate conversion (subtitle fps -> video fps)
+    try:
+        time_offset = float(request.form.get('time_offset_ms') or 0)
+        subtitle_fps = float(request.form.get('subtitle_fps') or 0)
+        video_fps = float(request.form.get('video_fps') or 0)
+        if not all(math.isfinite(value) for value in (time_offset, subtitle_fps, video_fps)):
+            raise ValueError('inf / nan')
+        time_offset_ms = int(time_offset)
+    except (ValueError, OverflowError):
+        return None, (jsonify({'error': 'Invalid retiming parameters'}), 400)
+    framerate_ratio = subtitle_fps / video_fps if subtitle_fps > 0 and video_fps > 0 else 1.0
 
     # Print parameters
     logger.info(f"Lang suffix: {lang_suffix}")
     logger.info(f"Overwrite: {overwrite}")
+    logger.info(f"Normalize encoding: {normalize_encoding}")
+    logger.info(f"Convert to SRT: {convert_to_srt}")
+    logger.info(f"Time offset: {time_offset_ms} ms, framerate ratio: {framerate_ratio}")
+
+    options = {
+        'lang_suffix': lang_suffix,
+        'overwrite': overwrite,
+        'normalize_encoding': normalize_encoding,
+        'convert_to_srt': convert_to_srt,
+        'time_offset_ms': time_offset_ms,
+        'framerate_ratio': framerate_ratio,
+        'match_cache': match_cache,
+        'index_cache': index_cache,
+        'title_aliases': title_aliases
+    }
+    return options, None
+
+def upload_names(filename):
+    """
+    (source name, stored name) of an uploaded file name: the source name is what the pipeline parses,
+    the original base name without path separators and control characters, since secure_filename()
+    drops every non-ASCII character (绝命毒师.S01E01.ass -> S01E01.ass); the file is stored under the secured name
+    """
+    source_name = filename.replace('\\', '/').rsplit('/', 1)[-1]
+    source_name = ''.join(char for char in source_name if unicodedata.category(char)[0] != 'C').strip()
+    stem, ext = os.path.splitext(source_name)
+    if not stem or not ext:
+        return source_name, ''
+    return source_name, f"{secure_filename(stem) or 'upload'}{ext.lower()}"
+
+def upload_filename_allowed(filename):
+    allowed_extensions = set()
+    # Add both subtitle and subtitle pack extensions
+    for ext in config_manager.subtitle_extensions + config_manager.subtitle_pack_extensions:
+        allowed_extensions.add(ext[1:])  # Remove the dot from extension
+    return allowed_file(filename, allowed_extensions)
 
-    if file:
-        filename = secure_filename(file.filename)
-        logger.info(f"Uploading file: {filename}")
-        allowed_extensions = set()
-        # Add both subtitle and subtitle pack extensions
-        for ext in config_manager.subtitle_extensions + config_manager.subtitle_pack_extensions:
-            allowed_extensions.add(ext[1:])  # Remove the dot from extension
+def receive_upload():
+    """
+    Validate the upload request and save the file to the temp directory
+    Returns (temp_path, processing options, None) or (None, None, error response)
+    """
+    if 'file' not in request.files:
+        return None, None, (jsonify({'error': 'No file part'}), 400)
+    
+    file = request.files['file']
+    if file.filename == '':
+        return None, None, (jsonify({'error': 'No selected file'}), 400)
+
+    options, error = parse_upload_options()
+    if error:
+        return None, None, error
 
-        if not allowed_file(filename, allowed_extensions):
-            return jsonify({'error': 'File type not allowed'}), 400
+    source_name, filename = upload_names(file.filename)
+    logger.info(f"Uploading file: {source_name}")
+    if not filename or not upload_filename_allowed(filename):
+        return None, None, (jsonify({'error': 'File type not allowed'}), 400)
 
-        # Save file to temp directory
-        temp_path = os.path.join(config_manager.temp_dir, filename)
-        file.save(temp_path)
+    # Save file to temp directory, the pipeline parses the original name. Unique, as CJK names secure to
+    # the same name (绝命毒师.S01E01.ass and 权力的游戏.S01E01.ass are both S01E01.ass)
+    temp_path = os.path.join(config_manager.temp_dir, f"{secrets.token_hex(4)}_{filename}")
+    file.save(temp_path)
+    options['source_name'] = source_name
+    return temp_path, options, None
+
+def is_admin(token):
+    # Admin-only features are disabled until admin_token is set in the config
+    return bool(config_manager.admin_token) and hmac.compare_digest(token or '', config_manager.admin_token)
+
+def profiling_requested():
+    # X-NeatSub-Profile: <admin token> header or ?profile=<admin token>
+    token = request.headers.get('X-NeatSub-Profile') or request.args.get('profile')
+    return token is not None and is_admin(token)
+
+def busy_response(e):
+    # Turned away by the stage limits (see stage_limits.py), the client retries after Retry-After
+    response = jsonify({'error': str(e), 'stage': e.stage, 'retry_after': e.retry_after})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 429
+
+def admit_upload():
+    """ None if the processing stages can queue another upload, else a 429 response """
+    try:
+        check_stages(config_manager)
+    except StageBusyError as e:
+        logger.warning(f"✗ Upload turned away: {str(e)}")
+        return busy_response(e)
+    return None
 
+def process_upload(temp_path, options, cleanup=None, profile=False):
+    """ Run the pipeline on an uploaded file and answer with all results at once, cleanup(busy) runs after it """
+    busy = False
+    try:
+        # Process the subtitle file with new parameters
+        if profile:
+            results, profile_name = run_profiled(config_manager.profiles_path, os.path.basename(temp_path),
+                                                 process_subtitle_file, temp_path, config_manager, **options)
+        else:
+            results, profile_name = process_subtitle_file(temp_path, config_manager, **options), None
+        response = {
+            'message': 'File processed successfully',
+            'results': results
+        }
+        if profile_name:
+            response['profile'] = profile_name  # download from /profiles
+        return jsonify(response)
+    except StageBusyError as e:
+        logger.warning(f"✗ Upload turned away: {str(e)}")
+        busy = True
+        return busy_response(e)
+    except Exception as e:
+        logger.error(f"Error processing file: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        if cleanup:
+            cleanup(busy)
+
+def stream_upload_events(temp_path, options, cleanup=None):
+    """ Run the pipeline on an uploaded file, sending every processing step as a server-sent event """
+    def generate():
+        busy = False
         try:
-            # Process the subtitle file with new parameters
-            results = process_subtitle_file(temp_path, config_manager, lang_suffix=lang_suffix, overwrite=overwrite)
-            return jsonify({
-                'message': 'File processed successfully',
-                'results': results
-            })
+            for event in process_subtitle_file_events(temp_path, config_manager, **options):
+                yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+        except StageBusyError as e:
+            logger.warning(f"✗ Upload turned away: {str(e)}")
+            busy = True
+            error = {'event': 'error', 'error': str(e), 'stage': e.stage, 'retry_after': e.retry_after}
+            yield f"event: error\ndata: {json.dumps(error)}\n\n"
         except Exception as e:
             logger.error(f"Error processing file: {str(e)}")
-            return jsonify({'error': str(e)}), 500
+            yield f"event: error\ndata: {json.dumps({'event': 'error', 'error': str(e)})}\n\n"
+        finally:
+            if cleanup:
+                cleanup(busy)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/upload', methods=['POST'])
+def upload_subtitle():
+    error = admit_upload()
+    if error:
+        return error
+    temp_path, options, error = receive_upload()
+    if error:
+        return error
+    return process_upload(temp_path, options, profile=profiling_requested())
+
+@app.route('/upload/stream', methods=['POST'])
+def upload_subtitle_stream():
+    # Same as /upload, but every processing step is sent as a server-sent event
+    error = admit_upload()
+    if error:
+        return error
+    temp_path, options, error = receive_upload()
+    if error:
+        return error
+    return stream_upload_events(temp_path, options)
+
+#========== Resumable chunked uploads ==========#
+# POST /upload/chunked {filename, size} -> upload_id, GET .../<id> -> stored offset,
+# PUT .../<id>?offset=N with the raw chunk as body, POST .../<id>/complete[/stream] with the form options
+
+def chunked_upload_error(e):
+    return jsonify({'error': str(e), 'offset': e.offset}), e.status_code
+
+@app.route('/upload/chunked', methods=['POST'])
+def create_chunked_upload():
+    data = request.get_json(silent=True) or {}
+    source_name, filename = upload_names(str(data.get('filename', '')))
+    if not source_name:
+        return jsonify({'error': 'No selected file'}), 400
+    if not filename or not upload_filename_allowed(filename):
+        return jsonify({'error': 'File type not allowed'}), 400
+    try:
+        size = int(data.get('size', 0))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid upload size'}), 400
+    try:
+        return jsonify(upload_store.create(filename, size, source_name))
+    except ChunkedUploadError as e:
+        return chunked_upload_error(e)
+
+@app.route('/upload/chunked/<upload_id>', methods=['GET'])
+def chunked_upload_status(upload_id):
+    try:
+        return jsonify(upload_store.status(upload_id))
+    except ChunkedUploadError as e:
+        return chunked_upload_error(e)
+
+@app.route('/upload/chunked/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    try:
+        offset = int(request.args.get('offset', ''))
+    except ValueError:
+        return jsonify({'error': 'Invalid offset'}), 400
+    try:
+        return jsonify({'upload_id': upload_id, 'offset': upload_store.write_chunk(upload_id, offset, request.stream)})
+    except ChunkedUploadError as e:
+        return chunked_upload_error(e)
+
+@app.route('/upload/chunked/<upload_id>', methods=['DELETE'])
+def cancel_chunked_upload(upload_id):
+    upload_store.discard(upload_id)
+    return jsonify({'message': 'Upload discarded'})
+
+def finish_chunked_upload(upload_id, busy):
+    # Turned away by a stage inside the pipeline: keep the upload for another complete after Retry-After
+    if busy:
+        upload_store.reopen(upload_id)
+    else:
+        upload_store.discard(upload_id)
+
+def complete_chunked_upload(upload_id, respond):
+    # A turned away upload stays stored, complete can be sent again after Retry-After
+    error = admit_upload()
+    if error:
+        return error
+    options, error = parse_upload_options()
+    if error:
+        return error
+    try:
+        options['source_name'] = upload_store.source_name(upload_id)
+        temp_path = upload_store.assemble(upload_id)
+    except ChunkedUploadError as e:
+        return chunked_upload_error(e)
+    # The assembled file is processed in place, its upload directory goes once the pipeline is done
+    return respond(temp_path, options, cleanup=lambda busy: finish_chunked_upload(upload_id, busy))
+
+@app.route('/upload/chunked/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    return complete_chunked_upload(upload_id, process_upload)
+
+@app.route('/upload/chunked/<upload_id>/complete/stream', methods=['POST'])
+def complete_upload_stream(upload_id):
+    return complete_chunked_upload(upload_id, stream_upload_events)
+
+@app.route("/health", methods=["GET"])
+def health():
+    # 503 until the library index is warm, so the container is only reported healthy once it's fast
+    # stages: running / waiting requests per processing stage, across all workers
+    status = {'ready': index_cache.ready, 'libraries': index_cache.status(), 'stages': get_stage_status(config_manager)}
+    return jsonify(status), (200 if index_cache.ready else 503)
+
+@app.route("/scan/progress", methods=["GET"])
+def scan_progress():
+    # Progress of the library scans run by this worker process
+    return jsonify({'scans': get_scan_progress()})
+
+#========== Profiles ==========#
+
+@app.route("/profiles", methods=["GET"])
+def profiles():
+    # Profiles of /upload requests made with the admin profiling flag
+    if not is_admin(request.headers.get('X-NeatSub-Admin') or request.args.get('token')):
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify({'profiles': list_profiles(config_manager.profiles_path)})
+
+@app.route("/profiles/<path:file_name>", methods=["GET"])
+def download_profile(file_name):
+    if not is_admin(request.headers.get('X-NeatSub-Admin') or request.args.get('token')):
+        return jsonify({'error': 'Forbidden'}), 403
+    if file_name != secure_filename(file_name):
+        return jsonify({'error': 'Invalid profile name'}), 400
+    return send_from_directory(config_manager.profiles_path, file_name, as_attachment=True)
+
+#========== Library queries ==========#
+# Answered from the library indexes (scanned at most once per library_index_ttl), never by walking the disk
+
+LIBRARY_PAGE_SIZE = 50
+LIBRARY_MAX_PAGE_SIZE = 500
+
+def selected_libraries():
+    """ Libraries named by the `library` query parameter (all if missing), None if no library has that name """
+    library_name = request.args.get('library')
+    libraries = [library for library in config_manager.media_libraries
+                 if library_name is None or library['library_name'] == library_name]
+    return libraries if libraries or library_name is None else None
+
+def paginate(items, key):
+    """ One page of items from the page / per_page query parameters, or an error response """
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+        per_page = min(max(int(request.args.get('per_page', LIBRARY_PAGE_SIZE)), 1), LIBRARY_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'error': 'Invalid page parameters'}), 400
+    start = (page - 1) * per_page
+    return jsonify({'page': page, 'per_page': per_page, 'total': len(items), key: items[start:start + per_page]})
+
+@app.route("/library", methods=["GET"])
+def library_shows():
+    # Shows with their seasons and how many episodes have a sidecar subtitle (?library=&show=<part of name>)
+    libraries = selected_libraries()
+    if libraries is None:
+        return jsonify({'error': 'Unknown library'}), 404
+
+    shows = []
+    for library in libraries:
+        video_index = index_cache.get(library, config_manager)
+        for show in video_index.list_shows(request.args.get('show')):
+            show['library'] = library['library_name']
+            shows.append(show)
+    return paginate(shows, 'shows')
+
+@app.route("/library/patterns", methods=["GET"])
+def library_patterns():
+    # File name rules in the order they are tried, with how many video files each one parsed per library
+    libraries = selected_libraries()
+    if libraries is None:
+        return jsonify({'error': 'Unknown library'}), 404
+
+    errors = install_filename_rules(config_manager.filename_patterns)
+    for library in libraries:
+        index_cache.get(library, config_manager)  # rescans libraries indexed with other rules
+    scans = {progress['library_path']: progress for progress in get_scan_progress()}
+
+    coverage = []
+    for library in libraries:
+        scan = scans.get(library['library_path'], {})
+        coverage.append({
+            'library': library['library_name'],
+            'videos': scan.get('videos', 0),
+            'unparsed': scan.get('unparsed', 0),
+            'rules': scan.get('rule_counts', {})
+        })
+    rules = [{'name': rule['name'], 'pattern': rule['pattern'], 'source': rule['source']}
+             for rule in get_filename_matcher().rules]
+    return jsonify({'rules': rules, 'errors': errors, 'coverage': coverage})
+
+@app.route("/library/episodes", methods=["GET"])
+def library_episodes():
+    # Episodes of a show / season (?show=&year=&season=), ?missing=<language> lists those without
+    # a sidecar subtitle in that language (e.g. zh-CN, '' for untagged, * for no subtitle at all)
+    libraries = selected_libraries()
+    if libraries is None:
+        return jsonify({'error': 'Unknown library'}), 404
+    try:
+        season = int(request.args['season']) if request.args.get('season') else None
+    except ValueError:
+        return jsonify({'error': 'Invalid season'}), 400
+
+    episodes = []
+    for library in libraries:
+        video_index = index_cache.get(library, config_manager)
+        for video in video_index.query_episodes(request.args.get('show'), request.args.get('year'), season,
+                                                request.args.get('missing')):
+            episodes.append({
+                'library': library['library_name'],
+                'show_name': video.show_name,
+                'year': video.year,
+                'season': video.season,
+                'episode': video.episode,
+                'episode_end': video.episode_end,
+                'video_file': video.full_path,
+                'subtitle_files': list(video.subtitle_files)
+            })
+    return paginate(episodes, 'episodes')
 
 @app.route("/config", methods=["GET"])
 def get_config():
@@ -78,7 +477,8 @@ def get_config():
         "subtitle_file_extensions": config_manager.subtitle_extensions,
         "subtitle_pack_extensions": config_manager.subtitle_pack_extensions,
         "temp_dir": config_manager.temp_dir,
-        "media_libraries": config_manager.media_libraries
+        "media_libraries": config_manager.media_libraries,
+        "filename_patterns": config_manager.filename_patterns
     })
 
 @app.route("/config", methods=["POST"])
@@ -93,12 +493,22 @@ def update_config():
     if not isinstance(data["temp_dir"], str):
         return jsonify({'error': 'Invalid temp_dir'}), 400
 
+    # Optional, rejected as a whole if any rule is invalid
+    if "filename_patterns" in data:
+        if not isinstance(data["filename_patterns"], list):
+            return jsonify({'error': 'Invalid filename_patterns'}), 400
+        errors = [error for error in map(validate_rule, data["filename_patterns"]) if error]
+        if errors:
+            return jsonify({'error': 'Invalid filename_patterns', 'details': errors}), 400
+
     try:
         config_manager.video_extensions = data["video_file_extensions"]
         config_manager.subtitle_extensions = data["subtitle_file_extensions"]
         config_manager.subtitle_pack_extensions = data["subtitle_pack_extensions"]
         config_manager.temp_dir = data["temp_dir"]
         config_manager.media_libraries = data["media_libraries"]
+        if "filename_patterns" in data:
+            config_manager.filename_patterns = data["filename_patterns"]
         config_manager.save()  # Save the updated config to file
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -106,4 +516,8 @@ def update_config():
     return jsonify({'message': 'Config updated successfully'})
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
+    if WATCH_MODE:
+        run_watch_daemon(config_manager)
+    else:
+        start_index_warmup()
+        app.run(debug=True, port=5000)
@@ -0,0 +1,192 @@
+"""
+    Admission control for the processing stages of NeatSub
+    Extracting packs, scanning libraries and moving subtitles each get a number of slots shared by all
+    gunicorn workers (and the watch daemon), so a burst of uploads queues up instead of hitting the disk at once.
+    Slots are lock files in <temp_dir>/stages/, held with flock() (released by the kernel if a worker dies):
+        <stage>.run.<n>.lock    held while a request runs the stage (concurrency)
+        <stage>.wait.<n>.lock   held while a request waits for a run slot (queue_depth)
+    A request that finds every run and wait slot taken fails fast with StageBusyError (HTTP 429 + Retry-After).
+"""
+from typing import Dict, List
+import os
+import math
+import time
+import threading
+from contextlib import contextmanager
+
+from config_manager import ConfigManager
+
+try:
+    import fcntl
+except ImportError:  # Windows, slots are only shared by the threads of one process there
+    fcntl = None
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+STAGES = ('extraction', 'scanning', 'moving')
+POLL_INTERVAL = 0.05  # seconds between attempts of a waiting request
+
+
+class StageBusyError(RuntimeError):
+    """ A stage's run and wait slots are all taken, or a wait slot was held for wait_timeout """
+
+    def __init__(self, stage: str, retry_after: int):
+        super().__init__(f"Server busy ({stage}), retry in {retry_after} s")
+        self.stage = stage
+        self.retry_after = retry_after
+
+
+_local_locks: Dict[str, threading.Lock] = {}   # slot path -> lock, without fcntl
+_local_locks_guard = threading.Lock()
+
+
+def try_lock_slot(path: str):
+    """ Lock handle of the slot, None if it is held """
+    if fcntl is None:
+        with _local_locks_guard:
+            lock = _local_locks.setdefault(path, threading.Lock())
+        return lock if lock.acquire(blocking=False) else None
+
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def unlock_slot(handle) -> None:
+    """ Release a slot taken with try_lock_slot """
+    if fcntl is None:
+        handle.release()
+    else:
+        os.close(handle)  # closing the descriptor drops the flock
+
+
+def _is_held(path: str) -> bool:
+    if fcntl is None:
+        lock = _local_locks.get(path)
+        return lock is not None and lock.locked()
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return False  # never used
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        return False
+    except OSError:
+        return True
+    finally:
+        os.close(fd)
+
+
+class StageLimiter:
+    """ Run and wait slots of one stage, 0 concurrency = unlimited """
+
+    def __init__(self, stage: str, lock_dir: str, concurrency: int = 0, queue_depth: int = 0, wait_timeout: float = 30):
+        self.stage = stage
+        self.lock_dir = lock_dir
+        self.concurrency = concurrency
+        self.queue_depth = queue_depth
+        self.wait_timeout = wait_timeout
+        self._avg_seconds = 1.0   # moving average of how long this process holds a run slot
+        if concurrency > 0:
+            os.makedirs(lock_dir, exist_ok=True)
+
+    def _paths(self, kind: str, count: int) -> List[str]:
+        return [os.path.join(self.lock_dir, f"{self.stage}.{kind}.{n}.lock") for n in range(count)]
+
+    def _acquire_any(self, kind: str, count: int):
+        # Two sweeps: a status() probe may hold a free slot for an instant
+        for _ in range(2):
+            for path in self._paths(kind, count):
+                handle = try_lock_slot(path)
+                if handle is not None:
+                    return handle
+        return None
+
+    def retry_after(self) -> int:
+        """ Seconds until a queued request would probably get its turn """
+        return max(1, math.ceil(self._avg_seconds * (self.queue_depth + 1) / max(self.concurrency, 1)))
+
+    def check(self) -> None:
+        """ Raise StageBusyError if a new request would be turned away right now """
+        if self.concurrency <= 0:
+            return
+        status = self.status()
+        if status['running'] >= self.concurrency and status['waiting'] >= self.queue_depth:
+            raise StageBusyError(self.stage, self.retry_after())
+
+    @contextmanager
+    def slot(self):
+        """ Hold a run slot of the stage, waiting in the queue for at most wait_timeout """
+        if self.concurrency <= 0:
+            yield
+            return
+
+        handle = self._acquire_any('run', self.concurrency)
+        if handle is None:
+            wait_handle = self._acquire_any('wait', self.queue_depth)
+            if wait_handle is None:
+                logger.warning(f"✗ {self.stage} queue full, turning the request away")
+                raise StageBusyError(self.stage, self.retry_after())
+            try:
+                deadline = time.monotonic() + self.wait_timeout
+                logger.debug(f"  → Waiting for a {self.stage} slot")
+                while handle is None:
+                    if time.monotonic() > deadline:
+                        raise StageBusyError(self.stage, self.retry_after())
+                    time.sleep(POLL_INTERVAL)
+                    handle = self._acquire_any('run', self.concurrency)
+            finally:
+                unlock_slot(wait_handle)
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            unlock_slot(handle)
+            self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * (time.monotonic() - started)
+
+    def status(self) -> Dict:
+        """ Slots in use across all processes """
+        if self.concurrency <= 0:
+            return {'stage': self.stage, 'concurrency': 0, 'queue_depth': 0, 'running': 0, 'waiting': 0}
+        return {
+            'stage': self.stage,
+            'concurrency': self.concurrency,
+            'queue_depth': self.queue_depth,
+            'running': sum(_is_held(path) for path in self._paths('run', self.concurrency)),
+            'waiting': sum(_is_held(path) for path in self._paths('wait', self.queue_depth)),
+            'avg_seconds': round(self._avg_seconds, 2)
+        }
+
+
+# One limiter per stage in this process, recreated when its limits change in the config
+_limiters: Dict[str, StageLimiter] = {}
+_registry_lock = threading.Lock()
+
+
+def get_stage_limiter(stage: str, config_manager: ConfigManager) -> StageLimiter:
+    limits = config_manager.stage_limits[stage]
+    lock_dir = os.path.join(config_manager.temp_dir, 'stages')
+    with _registry_lock:
+        limiter = _limiters.get(stage)
+        if (limiter is None or limiter.lock_dir != lock_dir or limiter.concurrency != limits['concurrency']
+                or limiter.queue_depth != limits['queue_depth'] or limiter.wait_timeout != limits['wait_timeout']):
+            limiter = StageLimiter(stage, lock_dir, limits['concurrency'], limits['queue_depth'], limits['wait_timeout'])
+            _limiters[stage] = limiter
+        return limiter
+
+
+def check_stages(config_manager: ConfigManager, stages: tuple = STAGES) -> None:
+    """ Turn a request away before it starts if one of the stages it needs is full """
+    for stage in stages:
+        get_stage_limiter(stage, config_manager).check()
+
+
+def get_stage_status(config_manager: ConfigManager) -> List[Dict]:
+    return [get_stage_limiter(stage, config_manager).status() for stage in STAGES]
@@ -0,0 +1,280 @@
+"""
+    Subtitle content processing for NeatSub
+    Functions:
+        1. Detect the text encoding of a subtitle file from a bounded prefix sample
+        2. Transcode a subtitle file to UTF-8 chunk by chunk (never loading it whole)
+        3. Convert ASS / SSA subtitles to SRT as a stream of cues
+        4. Retime SRT / ASS / SSA subtitles (constant offset and framerate ratio)
+"""
+
+from typing import Optional, Iterable, Iterator, Tuple
+from array import array
+import os
+import re
+import codecs
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+ENCODING_SAMPLE_SIZE = 64 * 1024  # bytes inspected to guess the encoding
+TRANSCODE_CHUNK_SIZE = 64 * 1024  # bytes decoded / encoded per step
+
+# Byte order marks, longest first (UTF-32 LE starts with the UTF-16 LE mark)
+BOM_ENCODINGS = [
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+# Legacy Chinese encodings used by fansub groups, GB18030 is a superset of GBK / GB2312
+LEGACY_ENCODINGS = ['gb18030', 'big5']
+
+# The most frequent Chinese characters, in simplified and traditional form.
+# Big5 bytes decoded as GB18030 (and vice versa) turn into rare characters instead.
+COMMON_HANZI = set(
+    '的一是不了在人有我他这个们中来上大为和国地到以说时要就出也得里后自会你么那好没看去过还'
+    '這個們來為國說時裡後會麼沒過還'
+)
+
+ASS_EXTENSIONS = {'.ass', '.ssa'}
+
+ASS_OVERRIDE_TAG_RE = re.compile(r'\{[^}]*\}')  # {\k20}, {\pos(1,2)\fs40}, ...
+ASS_DRAWING_TAG_RE = re.compile(r'\\p[1-9]')   # {\p1} switches the line to vector drawing mode
+TIMESTAMP_RE = re.compile(r'(\d+):(\d{1,2}):(\d{1,2})[.,:](\d{1,3})')
+
+# Timing lines, with the two timestamps as named groups so they can be replaced in place
+SRT_TIMING_RE = re.compile(
+    r'^\s*(?P<start>\d+:\d{1,2}:\d{1,2}[,.]\d{1,3})\s*-->\s*(?P<end>\d+:\d{1,2}:\d{1,2}[,.]\d{1,3})')
+ASS_TIMING_RE = re.compile(
+    r'^(?:Dialogue|Comment):[^,]*,\s*(?P<start>\d+:\d{1,2}:\d{1,2}[.:]\d{1,3})\s*,'
+    r'\s*(?P<end>\d+:\d{1,2}:\d{1,2}[.:]\d{1,3})\s*,')
+
+
+def _decodes_cleanly(sample: bytes, encoding: str) -> Optional[str]:
+    """ Decode a sample strictly, tolerating a multi-byte character cut at the end of the sample """
+    decoder = codecs.getincrementaldecoder(encoding)(errors='strict')
+    try:
+        return decoder.decode(sample, final=False)
+    except UnicodeDecodeError:
+        return None
+
+
+def detect_encoding(file_path: str, sample_size: int = ENCODING_SAMPLE_SIZE) -> Optional[str]:
+    """ Guess the encoding of a text file from its first sample_size bytes, None if unknown """
+    with open(file_path, 'rb') as f:
+        sample = f.read(sample_size)
+
+    for bom, encoding in BOM_ENCODINGS:
+        if sample.startswith(bom):
+            return encoding
+
+    # UTF-16 without BOM: ASCII-heavy subtitle text leaves every other byte zero (and NUL bytes are valid UTF-8)
+    if len(sample) >= 2 and sample.count(b'\x00') > len(sample) // 4:
+        if sample[1::2].count(b'\x00') > sample[0::2].count(b'\x00'):
+            return 'utf-16-le'
+        return 'utf-16-be'
+
+    if _decodes_cleanly(sample, 'utf-8') is not None:
+        return 'utf-8'
+
+    # A legacy encoding only counts if it turns up common Chinese characters, Shift-JIS and others often decode too
+    best_encoding = None
+    best_score = 0
+    for encoding in LEGACY_ENCODINGS:
+        text = _decodes_cleanly(sample, encoding)
+        if text is None:
+            continue
+        score = sum(1 for char in text if char in COMMON_HANZI)
+        if score > best_score:
+            best_encoding = encoding
+            best_score = score
+
+    return best_encoding
+
+
+def _write_chunks(dest_path: str, chunks: Iterable[bytes]) -> None:
+    """ Write byte chunks next to dest_path first, so players never see a half-written subtitle """
+    part_path = dest_path + '.part'
+    try:
+        with open(part_path, 'wb') as dst:
+            for chunk in chunks:
+                dst.write(chunk)
+        os.replace(part_path, dest_path)
+    except Exception:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
+
+def _iter_transcoded(src_path: str, encoding: str, chunk_size: int) -> Iterator[bytes]:
+    """ Yield src_path re-encoded as UTF-8, one fixed-size input chunk at a time """
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    encoder = codecs.getincrementalencoder('utf-8')()
+
+    with open(src_path, 'rb') as src:
+        while True:
+            chunk = src.read(chunk_size)
+            if not chunk:
+                break
+            yield encoder.encode(decoder.decode(chunk))
+    yield encoder.encode(decoder.decode(b'', final=True), final=True)
+
+
+def transcode_to_utf8(src_path: str, dest_path: str, encoding: str, chunk_size: int = TRANSCODE_CHUNK_SIZE) -> None:
+    """ Stream src_path in the given encoding to dest_path as UTF-8 (without BOM) """
+    _write_chunks(dest_path, _iter_transcoded(src_path, encoding, chunk_size))
+
+
+#========== ASS / SSA to SRT ==========#
+
+def parse_timestamp(value: str) -> Optional[int]:
+    """ Parse an ASS (H:MM:SS.cc) or SRT (HH:MM:SS,mmm) timestamp into milliseconds """
+    match = TIMESTAMP_RE.match(value.strip())
+    if not match:
+        return None
+    hours, minutes, seconds, fraction = match.groups()
+    # centiseconds in ASS, but be lenient with 1 or 3 digit fractions
+    millis = int(fraction.ljust(3, '0'))
+    return ((int(hours) * 60 + int(minutes)) * 60 + int(seconds)) * 1000 + millis
+
+
+def format_srt_time(millis: int) -> str:
+    """ Format milliseconds as an SRT timestamp (HH:MM:SS,mmm) """
+    millis = max(millis, 0)
+    seconds, millis = divmod(millis, 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d},{millis:03d}"
+
+
+def format_ass_time(millis: int) -> str:
+    """ Format milliseconds as an ASS timestamp (H:MM:SS.cc) """
+    centis = (max(millis, 0) + 5) // 10
+    seconds, centis = divmod(centis, 100)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:d}:{minutes:02d}:{seconds:02d}.{centis:02d}"
+
+
+def iter_text_lines(file_path: str, encoding: str, chunk_size: int = TRANSCODE_CHUNK_SIZE) -> Iterator[str]:
+    """ Yield the decoded lines of a text file with their original line endings, reading it in fixed-size chunks """
+    with open(file_path, 'r', encoding=encoding, errors='replace', newline='', buffering=chunk_size) as f:
+        for line in f:
+            yield line
+
+
+def iter_ass_events(lines: Iterable[str]) -> Iterator[Tuple[int, int, str]]:
+    """ Yield (start_ms, end_ms, plain_text) for every Dialogue line in the [Events] section """
+    in_events = False
+    fields = ['layer', 'start', 'end', 'style', 'name', 'marginl', 'marginr', 'marginv', 'effect', 'text']
+    start_index, end_index, text_index = 1, 2, 9
+
+    for line in lines:
+        line = line.strip().lstrip('\ufeff')
+        if line.startswith('['):
+            in_events = line.lower() == '[events]'
+            continue
+        if not in_events or ':' not in line:
+            continue
+
+        key, value = line.split(':', 1)
+        key = key.strip().lower()
+        if key == 'format':
+            fields = [field.strip().lower() for field in value.split(',')]
+            if not {'start', 'end', 'text'} <= set(fields):
+                return  # not an ASS event table we understand
+            start_index, end_index, text_index = fields.index('start'), fields.index('end'), fields.index('text')
+            continue
+        if key != 'dialogue':
+            continue  # Comment, Picture, Sound, ...
+
+        # Only the last field (Text) may contain commas
+        values = value.lstrip().split(',', len(fields) - 1)
+        if len(values) != len(fields):
+            continue
+
+        text = values[text_index]
+        if ASS_DRAWING_TAG_RE.search(text):
+            continue  # vector drawing, not readable text
+
+        start = parse_timestamp(values[start_index])
+        end = parse_timestamp(values[end_index])
+        if start is None or end is None:
+            continue
+
+        text = ASS_OVERRIDE_TAG_RE.sub('', text)
+        text = text.replace('\\N', '\n').replace('\\n', '\n').replace('\\h', ' ').strip()
+        if text:
+            yield start, end, text
+
+
+def iter_srt_cues(events: Iterable[Tuple[int, int, str]]) -> Iterator[str]:
+    """ Yield numbered SRT cues, one per event """
+    for index, (start, end, text) in enumerate(events, 1):
+        yield f"{index}\n{format_srt_time(start)} --> {format_srt_time(end)}\n{text}\n\n"
+
+
+def convert_ass_to_srt(src_path: str, dest_path: str, encoding: str = 'utf-8') -> int:
+    """ Convert an ASS / SSA file to a UTF-8 SRT file cue by cue, return the number of cues """
+    cue_count = 0
+
+    def encoded_cues():
+        nonlocal cue_count
+        for cue in iter_srt_cues(iter_ass_events(iter_text_lines(src_path, encoding))):
+            cue_count += 1
+            yield cue.encode('utf-8')
+
+    _write_chunks(dest_path, encoded_cues())
+    return cue_count
+
+
+#========== Retiming ==========#
+
+def retime_subtitle(src_path: str, dest_path: str, offset_ms: int = 0, framerate_ratio: float = 1.0,
+                    encoding: Optional[str] = 'utf-8') -> int:
+    """
+    Shift and scale all cue timestamps of an SRT / ASS / SSA file: new = old * framerate_ratio + offset_ms
+    (framerate_ratio = subtitle fps / video fps, e.g. 25 / 23.976 for a PAL subtitle on a WEB release).
+    The output is UTF-8 and src_path may equal dest_path. Returns the number of retimed cues.
+    With encoding None (unknown) the file is read byte for byte as latin-1: only the ASCII timestamps
+    change and the text keeps its original bytes (cp1252, Shift-JIS, ...).
+    """
+    # latin-1 maps every byte to one character and back, the timing lines are ASCII in any legacy encoding
+    read_encoding, write_encoding = (encoding, 'utf-8') if encoding else ('latin-1', 'latin-1')
+
+    file_ext = os.path.splitext(src_path)[1].lower()
+    if file_ext == '.srt':
+        timing_re, format_time = SRT_TIMING_RE, format_srt_time
+    elif file_ext in ASS_EXTENSIONS:
+        timing_re, format_time = ASS_TIMING_RE, format_ass_time
+    else:
+        raise ValueError(f"Retiming is not supported for {file_ext} subtitles")
+
+    # Pass 1: collect every start / end timestamp into one compact int64 array
+    timestamps = array('q')
+    for line in iter_text_lines(src_path, read_encoding):
+        match = timing_re.match(line)
+        if match:
+            timestamps.append(parse_timestamp(match.group('start')))
+            timestamps.append(parse_timestamp(match.group('end')))
+
+    # Transform the whole array in one batch
+    timestamps = array('q', [max(round(t * framerate_ratio + offset_ms), 0) for t in timestamps])
+
+    # Pass 2: stream the lines again, substituting the transformed timestamps in order
+    def retimed_lines():
+        position = 0
+        for line in iter_text_lines(src_path, read_encoding):
+            match = timing_re.match(line)
+            if match:
+                line = (line[:match.start('start')] + format_time(timestamps[position]) +
+                        line[match.end('start'):match.start('end')] + format_time(timestamps[position + 1]) +
+                        line[match.end('end'):])
+                position += 2
+            yield line.encode(write_encoding)
+
+    _write_chunks(dest_path, retimed_lines())
+    return len(timestamps) // 2
@@ -0,0 +1,89 @@
+"""
+    Benchmark the ASS / SSA to SRT conversion on large karaoke subtitles
+    Generates multi-MB karaoke ASS files (every syllable wrapped in {\\k} tags),
+    converts them and reports throughput and peak Python memory.
+        python benchmark_ass_to_srt.py
+"""
+
+import os
+import sys
+import time
+import random
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from subtitle_tools import convert_ass_to_srt
+
+# Target sizes of the generated ASS files (MB)
+FILE_SIZES_MB = [2, 8, 32]
+
+ASS_HEADER = """[Script Info]
+ScriptType: v4.00+
+PlayResX: 1920
+PlayResY: 1080
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
+Style: Karaoke,Arial,48,&H00FFFFFF,&H000000FF,&H00000000,&H00000000,0,0,0,0,100,100,0,0,1,2,0,8,10,10,10,1
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+"""
+
+SYLLABLES = ['ka', 'ra', 'o', 'ke', 'no', 'u', 'ta', 'shi', 'ma', 'su', '夜', '空', 'に', '星']
+
+
+def format_ass_time(millis):
+    centis = millis // 10
+    seconds, centis = divmod(centis, 100)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}.{centis:02d}"
+
+
+def generate_karaoke_ass(path, size_mb):
+    """Write a karaoke ASS file of roughly size_mb megabytes, return the number of events"""
+    target = size_mb * 1024 * 1024
+    written = 0
+    events = 0
+    start = 0
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(ASS_HEADER)
+        while written < target:
+            syllables = ''.join(
+                f"{{\\k{random.randint(10, 60)}\\1c&H{random.randint(0, 0xFFFFFF):06X}&}}{random.choice(SYLLABLES)}"
+                for _ in range(random.randint(8, 20))
+            )
+            line = (f"Dialogue: 0,{format_ass_time(start)},{format_ass_time(start + 4000)},Karaoke,,0,0,0,karaoke,"
+                    f"{{\\pos(960,80)\\fad(100,100)}}{syllables}\n")
+            f.write(line)
+            written += len(line.encode('utf-8'))
+            events += 1
+            start += 2500
+
+    return events
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for size_mb in FILE_SIZES_MB:
+            ass_path = os.path.join(temp_dir, f"karaoke_{size_mb}mb.ass")
+            srt_path = os.path.join(temp_dir, f"karaoke_{size_mb}mb.srt")
+            events = generate_karaoke_ass(ass_path, size_mb)
+            ass_size = os.path.getsize(ass_path)
+
+            start_time = time.perf_counter()
+            cues = convert_ass_to_srt(ass_path, srt_path)
+            elapsed = time.perf_counter() - start_time
+
+            # Second run for memory only, tracemalloc slows the conversion down considerably
+            tracemalloc.start()
+            convert_ass_to_srt(ass_path, srt_path)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            print(f"{size_mb:>4} MB | {events:>8} events | {cues:>8} cues | "
+                  f"{elapsed:6.2f} s | {ass_size / elapsed / 1024 / 1024:6.1f} MB/s | "
+                  f"peak {peak / 1024:7.1f} KiB")
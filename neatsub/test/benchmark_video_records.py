@@ -0,0 +1,88 @@
+"""
+    Memory benchmark for the video records kept by a library scan
+    Builds NUM_VIDEOS synthetic episodes (a few hundred shows, many seasons) and compares
+    the retained memory of the previous dict-per-video representation with VideoRecord,
+    plus the CLI's slotted VideoSubFile objects.
+        python benchmark_video_records.py [num_videos]
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+import logging
+logging.disable(logging.CRITICAL)  # parse_video_filename logs every file at DEBUG
+
+from neatsub import parse_video_filename, VideoRecord
+from neatsub_cli import VideoSubFile
+
+NUM_VIDEOS = 500000
+EPISODES_PER_SEASON = 20
+SEASONS_PER_SHOW = 10
+
+
+def generate_video_paths(count):
+    """Yield (directory, file name) pairs laid out like a Jellyfin TV library"""
+    per_show = EPISODES_PER_SEASON * SEASONS_PER_SHOW
+    for i in range(count):
+        show, rest = divmod(i, per_show)
+        season, episode = divmod(rest, EPISODES_PER_SEASON)
+        show_name = f"Show Number {show} ({2000 + show % 25})"
+        directory = f"/media/tvshow/{show_name}/Season {season + 1:02d}"
+        file_name = (f"{show_name.replace(' ', '.')}.S{season + 1:02d}E{episode + 1:02d}"
+                     f".1080p.WEB-DL.DDP5.1.H.264-GROUP.mkv")
+        yield directory, file_name
+
+
+def measure(build):
+    """Return (retained bytes, seconds) of the object graph returned by build()"""
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start_time
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, elapsed
+
+
+def build_dicts(paths):
+    """Previous representation: one parse_video_filename() dict per video, plus full_path"""
+    videos = []
+    for directory, file_name in paths:
+        video = parse_video_filename(file_name)
+        video['full_path'] = os.path.join(directory, file_name)
+        videos.append(video)
+    return videos
+
+
+def build_records(paths):
+    """Current scan_media_library() representation"""
+    videos = []
+    for directory, file_name in paths:
+        videos.append(VideoRecord(parse_video_filename(file_name), sys.intern(directory), file_name))
+    return videos
+
+
+def build_cli_files(paths):
+    return [VideoSubFile(os.path.join(directory, file_name)) for directory, file_name in paths]
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_VIDEOS
+    paths = list(generate_video_paths(count))
+
+    # Each build parses the names itself, so only what the representation retains is counted
+    # (the directory / file name strings come from the listing and are shared by all three)
+    for label, build in [
+        ("dict per video (previous)", lambda: build_dicts(paths)),
+        ("VideoRecord (slots + interning)", lambda: build_records(paths)),
+        ("CLI VideoSubFile (slots)", lambda: build_cli_files(paths)),
+    ]:
+        videos, retained, elapsed = measure(build)
+        print(f"{label:<34} {retained / 1024 / 1024:8.1f} MB | "
+              f"{retained / count:6.0f} B/video | {elapsed:6.2f} s")
+        del videos
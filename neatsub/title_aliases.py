@@ -0,0 +1,101 @@
+"""
+    Local show title alias table for NeatSub
+    Maps show titles used by subtitle packs (e.g. Chinese fansub names) to the titles of the library,
+    so they match exactly before any fuzzy scoring. The JSON file has two sections:
+        "aliases": edited by the user, {"绝命毒师": "Breaking Bad", ...}
+        "learned": written by NeatSub from placed matches whose titles differed
+    User aliases win over learned ones. Keys and values are normalized with normalize_title().
+"""
+import os
+import re
+import json
+from typing import Dict, Optional
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def normalize_title(title: str) -> str:
+    """ Lowercase, punctuation / underscores as spaces, single spaces """
+    return re.sub(r'\s+', ' ', re.sub(r'[^\w\s]|_', ' ', title.lower())).strip()
+
+
+class TitleAliases:
+    VERSION = 1
+    MAX_LEARNED = 10000
+
+    def __init__(self, alias_path: str):
+        """Initialize TitleAliases, the alias file is loaded lazily and reloaded when it changes"""
+        self._alias_path = alias_path
+        self._aliases: Dict[str, str] = {}   # normalized alias -> normalized library title
+        self._user: Dict[str, str] = {}
+        self._learned: Dict[str, str] = {}
+        self._loaded_mtime = None
+        self._dirty = False
+
+    def _reload_if_changed(self) -> None:
+        try:
+            mtime = os.path.getmtime(self._alias_path)
+        except OSError:
+            return
+        if mtime == self._loaded_mtime:
+            return
+
+        try:
+            with open(self._alias_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable title aliases {self._alias_path}: {str(e)}")
+            return
+
+        self._loaded_mtime = mtime
+        self._user = {normalize_title(alias): normalize_title(title)
+                      for alias, title in data.get('aliases', {}).items()}
+        learned = {normalize_title(alias): normalize_title(title)
+                   for alias, title in data.get('learned', {}).items()}
+        learned.update(self._learned if self._dirty else {})  # keep what this process learned but hasn't saved
+        self._learned = learned
+        self._aliases = {**self._learned, **self._user}
+
+    def lookup(self, title: str) -> Optional[str]:
+        """Normalized library title for a show title, None if it has no alias"""
+        self._reload_if_changed()
+        return self._aliases.get(normalize_title(title))
+
+    def learn(self, title: str, library_title: str) -> None:
+        """Remember that title was placed under library_title (kept in memory until save())"""
+        alias, target = normalize_title(title), normalize_title(library_title)
+        if not alias or alias == target or alias in self._user or self._learned.get(alias) == target:
+            return
+        logger.debug(f"  → Learned title alias: {title} -> {library_title}")
+        self._learned[alias] = target
+        self._aliases[alias] = target
+        self._dirty = True
+
+    def save(self) -> None:
+        """Write the learned aliases back, keeping the user section as it is in the file"""
+        if not self._dirty:
+            return
+        self._reload_if_changed()
+
+        data = {'version': self.VERSION, 'aliases': {}, 'learned': {}}
+        try:
+            with open(self._alias_path, 'r', encoding='utf-8') as f:
+                data.update(json.load(f))
+        except (OSError, ValueError):
+            pass
+        # dicts keep insertion order, so this keeps the most recently learned aliases
+        data['learned'] = dict(list(self._learned.items())[-self.MAX_LEARNED:])
+
+        part_path = f"{self._alias_path}.{os.getpid()}.part"  # one per gunicorn worker
+        try:
+            os.makedirs(os.path.dirname(self._alias_path) or '.', exist_ok=True)
+            with open(part_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=4)
+            os.replace(part_path, self._alias_path)
+        except OSError as e:
+            logger.warning(f"Could not save title aliases {self._alias_path}: {str(e)}")
+            return
+
+        self._loaded_mtime = os.path.getmtime(self._alias_path)
+        self._dirty = False
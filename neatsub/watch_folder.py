@@ -0,0 +1,212 @@
+"""
+    Watch-folder ingest daemon for NeatSub
+    Subtitle files / packs dropped into the configured inbox directories are processed without the web UI:
+        1. Poll the inboxes, a file is ready once its size and mtime stay the same for stable_seconds
+        2. Ready files arriving within debounce_seconds of each other form one batch
+        3. The batch is processed with one library index (each library scanned at most once per batch)
+        4. Results are appended to the log file (JSON lines), failed files are moved to the quarantine folder,
+           as are the subtitles of a processed pack that matched nothing (<quarantine>/<pack name>/)
+    Run with `python run.py --watch` or `python neatsub_cli.py --watch [config.json]`.
+"""
+from typing import Dict, List
+import os
+import json
+import time
+import shutil
+import signal
+import threading
+
+from config_manager import ConfigManager
+from match_cache import MatchCache
+from title_aliases import TitleAliases
+from neatsub import process_subtitle_file_events, LibraryIndexCache
+from stage_limits import StageBusyError
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class InboxWatcher:
+    def __init__(self, config_manager: ConfigManager):
+        self.config_manager = config_manager
+        self.settings = config_manager.watch_settings
+        self.inboxes = [os.path.abspath(inbox) for inbox in self.settings['inboxes']]
+        self.match_cache = MatchCache(config_manager.match_cache_path)
+        self.title_aliases = TitleAliases(config_manager.title_aliases_path)
+        self.log_path = config_manager.watch_log_path
+        self._observed: Dict[str, tuple] = {}   # path -> (size, mtime, unchanged since)
+        self._batch: List[str] = []
+        self._last_arrival = 0.0
+        self._stop = threading.Event()
+
+    def _allowed(self, file_name: str) -> bool:
+        extensions = self.config_manager.subtitle_extensions + self.config_manager.subtitle_pack_extensions
+        return (not file_name.startswith('.') and not file_name.endswith('.part')
+                and os.path.splitext(file_name)[1].lower() in extensions)
+
+    def _quarantine_dir(self, inbox: str) -> str:
+        return self.settings['quarantine_dir'] or os.path.join(inbox, 'quarantine')
+
+    def poll(self) -> List[str]:
+        """ Files that have become stable since the last poll """
+        now = time.time()
+        seen = set()
+        ready = []
+        for inbox in self.inboxes:
+            try:
+                with os.scandir(inbox) as it:
+                    entries = [entry for entry in it if entry.is_file() and self._allowed(entry.name)]
+            except OSError as e:
+                logger.warning(f"Cannot read inbox {inbox}: {str(e)}")
+                continue
+
+            for entry in entries:
+                if entry.path in self._batch:
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue  # removed meanwhile
+                seen.add(entry.path)
+                signature = (stat.st_size, stat.st_mtime)
+                observed = self._observed.get(entry.path)
+                if observed is None or observed[:2] != signature:
+                    self._observed[entry.path] = signature + (now,)  # new or still being written
+                elif now - observed[2] >= self.settings['stable_seconds']:
+                    ready.append(entry.path)
+                    del self._observed[entry.path]
+
+        # Forget files that disappeared before becoming stable
+        for path in list(self._observed):
+            if path not in seen:
+                del self._observed[path]
+        return ready
+
+    def _log(self, record: Dict) -> None:
+        try:
+            with open(self.log_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        except OSError as e:
+            logger.warning(f"Could not write watch log {self.log_path}: {str(e)}")
+
+    def _quarantine(self, file_path: str) -> str:
+        quarantine_dir = self._quarantine_dir(os.path.dirname(file_path))
+        os.makedirs(quarantine_dir, exist_ok=True)
+        dest_path = os.path.join(quarantine_dir, os.path.basename(file_path))
+        if os.path.exists(dest_path):
+            name, ext = os.path.splitext(os.path.basename(file_path))
+            dest_path = os.path.join(quarantine_dir, f"{name}.{time.strftime('%Y%m%d-%H%M%S')}{ext}")
+        shutil.move(file_path, dest_path)
+        return dest_path
+
+    def _drop_members(self, paths: List[str]) -> None:
+        """ Remove pack members set aside by the pipeline, and their folder once it is empty """
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        if paths:
+            try:
+                os.rmdir(os.path.dirname(paths[0]))
+            except OSError:
+                pass  # not empty, holds members of an earlier pack of the same name
+
+    def process_batch(self, file_paths: List[str]) -> None:
+        """ Process a batch of stable inbox files sharing one library index """
+        batch_started = time.time()
+        # Scanned on first use, only the directories changed since the last snapshot are read
+        index_cache = LibraryIndexCache(self.config_manager.library_index_ttl, self.config_manager.index_snapshot_path)
+        logger.info(f"→ Processing batch of {len(file_paths)} file(s)")
+
+        for file_path in file_paths:
+            record = {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'file': file_path}
+            # Pack members that were not placed go next to the quarantined files, in a folder named after the pack
+            members_dir = os.path.join(self._quarantine_dir(os.path.dirname(file_path)),
+                                       os.path.splitext(os.path.basename(file_path))[0])
+            results = []
+            set_aside = []
+            try:
+                for event in process_subtitle_file_events(file_path, self.config_manager,
+                                                          lang_suffix=self.settings['lang_suffix'],
+                                                          overwrite=self.settings['overwrite'],
+                                                          match_cache=self.match_cache, index_cache=index_cache,
+                                                          batch_started=batch_started, title_aliases=self.title_aliases,
+                                                          unmatched_dir=members_dir):
+                    if 'result' in event:
+                        results.append(event['result'])
+                    if 'set_aside' in event:
+                        set_aside.append(event['set_aside'])
+                record['results'] = results
+                if not results:
+                    record['error'] = 'No subtitle matched a video'
+            except StageBusyError as e:
+                # Left in the inbox, it is picked up again once it has been stable for stable_seconds
+                logger.warning(f"→ Deferred: {os.path.basename(file_path)} ({str(e)})")
+                record['deferred'] = str(e)
+                self._drop_members(set_aside)  # the pack is processed again
+                self._log(record)
+                continue
+            except Exception as e:
+                logger.error(f"✗ Error processing {file_path}: {str(e)}")
+                record['error'] = str(e)
+
+            if set_aside and 'error' not in record:
+                record['quarantined_members'] = set_aside
+                logger.info(f"✗ Quarantined {len(set_aside)} unmatched subtitle(s) of {os.path.basename(file_path)}")
+            elif set_aside:
+                self._drop_members(set_aside)  # the whole pack is quarantined below
+
+            if 'error' in record:
+                if os.path.exists(file_path):
+                    try:
+                        record['quarantined'] = self._quarantine(file_path)
+                    except OSError as e:
+                        logger.error(f"✗ Could not quarantine {file_path}: {str(e)}")
+            elif os.path.exists(file_path):
+                os.remove(file_path)  # a processed pack, its subtitles are in the library now
+
+            if 'quarantined' in record:
+                logger.info(f"✗ Quarantined: {os.path.basename(file_path)} ({record['error']})")
+            elif 'error' not in record:
+                logger.info(f"✓ Processed: {os.path.basename(file_path)} ({len(record['results'])} subtitle(s))")
+            self._log(record)
+
+    def run_once(self) -> None:
+        """ One poll, processing the pending batch once no file arrived for debounce_seconds """
+        ready = self.poll()
+        if ready:
+            self._batch.extend(ready)
+            self._last_arrival = time.time()
+        if self._batch and time.time() - self._last_arrival >= self.settings['debounce_seconds']:
+            batch, self._batch = self._batch, []
+            self.process_batch(batch)
+
+    def run(self) -> None:
+        if not self.inboxes:
+            logger.error("✗ No inbox configured, add directories to watch.inboxes in the config")
+            return
+        for inbox in self.inboxes:
+            os.makedirs(inbox, exist_ok=True)
+        logger.info(f"Watching {', '.join(self.inboxes)} (log: {self.log_path})")
+
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"✗ Watch loop error: {str(e)}")
+            self._stop.wait(self.settings['poll_interval'])
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def run_watch_daemon(config_manager: ConfigManager) -> None:
+    """ Run the watch-folder daemon in the foreground until interrupted (Ctrl+C / SIGTERM) """
+    watcher = InboxWatcher(config_manager)
+    signal.signal(signal.SIGTERM, lambda signum, frame: watcher.stop())
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        watcher.stop()
+    logger.info("Watch daemon stopped")
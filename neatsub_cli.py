@@ -5,6 +5,7 @@
 
 import os
 import re
+import sys
 
 # Define
 VIDEO_EXTENSIONS = {'.mp4', '.mkv', '.avi', '.mov', '.flv', '.wmv', '.webm', '.m4v', '.ts', '.3gp', '.3g2', '.m2ts', '.mts', '.f4v', '.vob', '.rmvb', '.ogv', '.ogg', '.mpg', '.mpeg', '.mpe', '.mpv', '.m2v', '.m4v', '.m2v', '.m1v', '.m2p', '.m2t', '.mp2v', '.mpv2', '.mp2', '.mpa', '.m1v', '.m2v'}
@@ -17,12 +18,21 @@ def is_path_effective(path):
     return os.path.exists(path) and os.path.isdir(path)
 
 class VideoSubFile:
+    __slots__ = ('path', 'metadata')
+
     def __init__(self, path):
         self.path = path
-        self.name = os.path.basename(path)
-        self.extension = os.path.splitext(path)[1]
         self.metadata = get_file_name_metadata(self.name)
 
+    # Derived from the path on demand, so large libraries don't store them per file
+    @property
+    def name(self):
+        return os.path.basename(self.path)
+
+    @property
+    def extension(self):
+        return os.path.splitext(self.path)[1]
+
 # Scan all video files in the directory
 def scan_video_files(path):
     print("Scan media files in the directory: ", path)
@@ -58,8 +68,10 @@ def scan_subtitle_files(path):
 #========== MetaData Processing ==========#
 
 class FileNameMetadata:
+    __slots__ = ('show_name', 'season', 'episode')
+
     def __init__(self, show_name, season, episode):
-        self.show_name = show_name
+        self.show_name = sys.intern(show_name) # shared by all episodes of the show
         self.season = season
         self.episode = episode
 
@@ -95,6 +107,8 @@ def get_file_name_metadata(filename):
 #========== Matching Processing ==========#
 
 class MatchingRelation:
+    __slots__ = ('video', 'subtitle')
+
     def __init__(self, video, subtitle):
         self.video = video
         self.subtitle = subtitle
@@ -106,6 +120,17 @@ def clear_screen():
 
 # main
 if __name__ == '__main__':
+    # Watch-folder daemon of the web version: python neatsub_cli.py --watch [config.json]
+    if len(sys.argv) > 1 and sys.argv[1] == '--watch':
+        neatsub_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'neatsub')
+        sys.path.insert(0, neatsub_dir)
+        from config_manager import ConfigManager
+        from watch_folder import run_watch_daemon
+
+        config_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(neatsub_dir, 'config.json')
+        run_watch_daemon(ConfigManager(os.path.abspath(config_path)))
+        sys.exit()
+
     clear_screen()
 
     print()